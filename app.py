@@ -1,29 +1,41 @@
 import os
-import logging
 from datetime import datetime
 from flask import Flask
 from flask_login import LoginManager
 from config import Config
 
-logging.basicConfig(level=logging.DEBUG)
+# Log through a background thread, as JSON lines
+import logs
+logs.configure(Config)
 
 # Create Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Initialize database
+# Initialize database. Importing the app doesn't touch the database; the schema
+# is created and upgraded by `flask --app main migrate` before the server starts
 from models import db, User, Group, Expense, Notification
 db.init_app(app)
 
+# Give every request an id for its log lines
+logs.init_app(app)
+
+# Collect per-request SQL and latency metrics
+import metrics
+metrics.init_app(app)
+
+# Keep users on the primary database right after they write
+import replica
+replica.init_app(app)
+
 # Initialize Login Manager
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Users are served from a per-worker cache (see user_cache.py)
+import user_cache
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
-
-# Create database tables if they don't exist
-with app.app_context():
-    db.create_all()
+    return user_cache.load_user(user_id)
@@ -0,0 +1,6 @@
+"""
+Benchmarks for the balance and settlement paths.
+
+Run them from the repository root:
+    python -m benchmarks.run --output bench.json
+"""
@@ -0,0 +1,81 @@
+"""
+Deterministic synthetic data for benchmarks.
+
+Builds transient User and Expense objects (nothing touches the database), so
+the balance and settlement functions can be timed on their own.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import configure_mappers, instrumentation
+
+from models import User, Group, Expense
+
+DEFAULT_CURRENCIES = ['USD', 'EUR', 'GBP', 'JPY', 'INR']
+
+def make_user(index):
+    """Create a transient user without hashing a password, which would dominate setup time."""
+    configure_mappers()
+    user = instrumentation.manager_of_class(User).new_instance()
+    user.id = f"user{index:05d}"
+    user.username = user.id
+    user.email = f"{user.id}@example.com"
+    user.password_hash = ''
+    user.preferred_currency = 'USD'
+    return user
+
+def generate_group(members=10, expenses=1000, currencies=None, custom_split_ratio=0.2,
+                   settled_ratio=0.1, max_participants=None, seed=42):
+    """
+    Generate a group with members and expenses.
+
+    Args:
+        members: Number of group members
+        expenses: Number of expenses
+        currencies: List of currency codes to draw expense currencies from
+        custom_split_ratio: Fraction of expenses using custom percentage splits
+        settled_ratio: Fraction of expenses marked as settled
+        max_participants: Largest number of participants per expense (default: all members, capped at 20)
+        seed: Random seed, so the same arguments always produce the same data
+
+    Returns:
+        A tuple (group, users, expenses)
+    """
+    rng = random.Random(seed)
+    currencies = currencies or DEFAULT_CURRENCIES
+    max_participants = min(max_participants or 20, members)
+
+    group = Group(name=f"Benchmark {members}x{expenses}", created_by=make_user(0).id)
+    group.id = f"bench-{members}-{expenses}-{seed}"
+
+    users = [make_user(index) for index in range(members)]
+    start = datetime(2024, 1, 1)
+
+    group_expenses = []
+    for index in range(expenses):
+        participants = rng.sample(users, rng.randint(1, max_participants))
+
+        custom_splits = None
+        if rng.random() < custom_split_ratio:
+            # Random whole percentages that add up to 100
+            cuts = sorted(rng.sample(range(1, 100), len(participants) - 1)) if len(participants) <= 99 else []
+            if len(cuts) == len(participants) - 1:
+                bounds = [0] + cuts + [100]
+                custom_splits = {user.id: bounds[i + 1] - bounds[i] for i, user in enumerate(participants)}
+
+        expense = Expense(
+            group_id=group.id,
+            amount=round(rng.uniform(1, 500), 2),
+            description=f"Expense {index}",
+            date=start + timedelta(hours=index),
+            payer=rng.choice(participants).id,
+            currency=rng.choice(currencies),
+            custom_splits=custom_splits
+        )
+        expense.id = f"expense{index:07d}"
+        expense.participants = participants
+        expense.settled = rng.random() < settled_ratio
+        group_expenses.append(expense)
+
+    return group, users, group_expenses
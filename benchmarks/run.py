@@ -0,0 +1,138 @@
+"""
+Time the balance and settlement paths at several scales and write the results as JSON.
+
+Usage:
+    python -m benchmarks.run [--members 10 100 1000] [--expenses 1000 100000]
+                             [--repeat 3] [--output results.json]
+"""
+
+import argparse
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.generator import DEFAULT_CURRENCIES, generate_group
+from config import Config
+from utils import calculate_balances, get_settlement_plan
+
+SPLIT_SAMPLE_SIZE = 1000
+
+def time_call(func, repeat):
+    """Run func repeat times and return the timings in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def summarize(name, params, timings, **extra):
+    result = {
+        'benchmark': name,
+        **params,
+        'repeat': len(timings),
+        'best_s': min(timings),
+        'mean_s': sum(timings) / len(timings),
+    }
+    result.update(extra)
+    return result
+
+def run_scale(members, expenses, currencies, custom_split_ratio, repeat, seed):
+    """Run every benchmark for one group size."""
+    group, users, group_expenses = generate_group(
+        members=members,
+        expenses=expenses,
+        currencies=currencies,
+        custom_split_ratio=custom_split_ratio,
+        seed=seed
+    )
+    params = {
+        'members': members,
+        'expenses': expenses,
+        'currencies': len(currencies),
+        'custom_split_ratio': custom_split_ratio,
+    }
+    results = []
+
+    timings = time_call(lambda: calculate_balances(group.id, group_expenses, users), repeat)
+    results.append(summarize('calculate_balances', params, timings))
+
+    timings = time_call(lambda: calculate_balances(group.id, group_expenses, users, 'USD'), repeat)
+    results.append(summarize('calculate_balances[display_currency]', params, timings))
+
+    balances = calculate_balances(group.id, group_expenses, users)
+    timings = time_call(lambda: get_settlement_plan(balances), repeat)
+    results.append(summarize('get_settlement_plan', params, timings,
+                             transfers=len(get_settlement_plan(balances))))
+
+    flat_balances = calculate_balances(group.id, group_expenses, users, 'USD')
+    timings = time_call(lambda: get_settlement_plan(flat_balances, 'USD'), repeat)
+    results.append(summarize('get_settlement_plan[display_currency]', params, timings,
+                             transfers=len(get_settlement_plan(flat_balances, 'USD'))))
+
+    # Per-call cost of the per-user split on a sample of expenses
+    sample = group_expenses[:SPLIT_SAMPLE_SIZE]
+    user_ids = [user.id for user in users]
+
+    def split_sample():
+        for index, expense in enumerate(sample):
+            expense.get_split_for_user(user_ids[index % len(user_ids)])
+
+    timings = time_call(split_sample, repeat)
+    results.append(summarize('Expense.get_split_for_user', params, timings,
+                             calls=len(sample),
+                             per_call_us=min(timings) / len(sample) * 1e6))
+
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--expenses', type=int, nargs='+', default=[1000, 100000])
+    parser.add_argument('--currencies', nargs='+', default=DEFAULT_CURRENCIES)
+    parser.add_argument('--custom-split-ratio', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    # Always benchmark against the fixed default rates, never the live API
+    Config.CURRENCY_API_KEY = None
+
+    results = []
+    # Keep anything the code under test prints out of the JSON on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        for members in args.members:
+            for expenses in args.expenses:
+                print(f"Running {members} members x {expenses} expenses...")
+                results.extend(run_scale(members, expenses, args.currencies, args.custom_split_ratio,
+                                         args.repeat, args.seed))
+
+    report = {
+        'generated_at': datetime.now().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Maintenance commands for the Flask CLI.
+
+Run them with the application pointed at main.py, e.g.:
+    flask --app main rebuild-ledger
+"""
+
+import gzip
+
+import click
+
+import migrator
+import query_plans
+import retention
+from app import app, db
+from outbox import run_worker
+from utils import backfill_expense_shares, groups_missing_ledger, rebuild_ledger
+
+@app.cli.command('migrate')
+@click.option('--target', default=None, help='Stop after this migration version (e.g. 0002).')
+def migrate_command(target):
+    """Create missing tables, apply pending schema migrations and build missing ledgers."""
+    db.create_all()
+    applied = migrator.upgrade(db.engine, target, echo=click.echo)
+
+    # Build the ledgers of groups from before the ledger existed, so pages never have to
+    for group_id in groups_missing_ledger():
+        rebuild_ledger(group_id)
+        db.session.commit()
+        click.echo(f"Built the balance ledger of group {group_id}")
+
+    click.echo(f"Database is up to date ({len(applied)} migrations applied).")
+
+@app.cli.command('migration-status')
+def migration_status_command():
+    """List schema migrations and whether they have been applied."""
+    for migration, applied_at in migrator.status(db.engine):
+        state = f"applied {applied_at}" if applied_at else "pending"
+        click.echo(f"{migration.version}_{migration.name}: {state}")
+
+@app.cli.command('explain-queries')
+@click.option('--group-id', default=None, help='Group to run the queries for (default: the largest).')
+@click.option('--user-id', default=None, help='User to run the queries for (default: a member of the group).')
+def explain_queries_command(group_id, user_id):
+    """Print query plans for the main routes and flag table scans."""
+    default_group_id, default_user_id = query_plans.default_group_and_user()
+    group_id = group_id or default_group_id
+    user_id = user_id or default_user_id
+    if not group_id or not user_id:
+        raise click.ClickException("No group to run the queries for; pass --group-id and --user-id.")
+
+    flagged = query_plans.report(group_id, user_id, echo=click.echo)
+    click.echo(f"{flagged} statements scan a table or sort without an index.")
+
+@app.cli.command('rebuild-ledger')
+@click.option('--group-id', default=None, help='Only rebuild the ledger for this group.')
+def rebuild_ledger_command(group_id):
+    """Regenerate the balance ledger from the expense tables."""
+    rows = rebuild_ledger(group_id)
+    db.session.commit()
+    click.echo(f"Balance ledger rebuilt ({rows} rows).")
+
+@app.cli.command('backfill-expense-shares')
+@click.option('--batch-size', default=500, show_default=True, help='Expenses to backfill per transaction.')
+def backfill_expense_shares_command(batch_size):
+    """Store owed shares for expenses written before the expense_share table existed (also run by migration 0006)."""
+    total = 0
+    for count in backfill_expense_shares(db.session, batch_size):
+        db.session.commit()
+        total += count
+        click.echo(f"Backfilled {total} expenses...")
+
+    click.echo(f"Expense shares backfilled ({total} expenses).")
+
+@app.cli.command('prune-notifications')
+@click.option('--days', default=None, type=int, help='Delete read notifications older than this (default: NOTIFICATION_RETENTION_DAYS).')
+@click.option('--keep', default=None, type=int, help='Read notifications to keep per user (default: NOTIFICATION_HISTORY_LIMIT).')
+@click.option('--archive', default=None, type=click.Path(dir_okay=False), help='Append deleted notifications to this gzipped JSON Lines file.')
+@click.option('--vacuum', is_flag=True, help='Compact the database afterwards.')
+def prune_notifications_command(days, keep, archive, vacuum):
+    """Delete old read notifications and cap each user's history."""
+    days = days if days is not None else app.config['NOTIFICATION_RETENTION_DAYS']
+    keep = keep if keep is not None else app.config['NOTIFICATION_HISTORY_LIMIT']
+
+    if archive:
+        with gzip.open(archive, 'at', encoding='utf-8') as archive_file:
+            deleted = retention.prune_notifications(days, keep, archive_file)
+    else:
+        deleted = retention.prune_notifications(days, keep)
+    click.echo(f"Deleted {deleted} notifications.")
+
+    if vacuum:
+        retention.compact_database(db.engine)
+        click.echo("Database compacted.")
+
+@app.cli.command('drain-outbox')
+@click.option('--once', is_flag=True, help='Send what is due and exit instead of polling.')
+@click.option('--workers', default=None, type=int, help='Concurrent batch requests to the email provider.')
+@click.option('--poll-interval', default=None, type=float, help='Seconds to wait between polls.')
+def drain_outbox_command(once, workers, poll_interval):
+    """Deliver queued emails from the outbox."""
+    api_key = app.config.get('RESEND_API_KEY')
+    if not api_key:
+        raise click.ClickException("RESEND_API_KEY is not configured.")
+
+    click.echo("Outbox worker started.")
+    run_worker(
+        api_key,
+        poll_interval=poll_interval or app.config['OUTBOX_POLL_INTERVAL'],
+        batch_size=app.config['OUTBOX_BATCH_SIZE'],
+        max_workers=workers or app.config['OUTBOX_WORKERS'],
+        once=once
+    )
@@ -1,22 +1,134 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+def engine_options(url, pool_size, max_overflow, pool_timeout, pre_ping, recycle):
+    """SQLAlchemy engine options for a database URL; in-memory SQLite has no pool to size."""
+    options = {'pool_pre_ping': pre_ping}
+    if url.startswith('sqlite') and (':memory:' in url or url.rstrip('/') in ('sqlite:', 'sqlite+pysqlite:')):
+        return options
+
+    options.update({
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': recycle,
+    })
+    return options
+
 class Config:
     """Base configuration."""
     # Application settings
     SECRET_KEY = os.environ.get('SESSION_SECRET', 'dev-secret-key')
     DEBUG = os.environ.get('DEBUG', 'False').lower() in ('true', '1', 't')
 
+    # Web server worker model (see gunicorn.conf.py). Workers default to the CPUs available
+    # to the container; each gthread worker serves GUNICORN_THREADS requests at a time
+    GUNICORN_WORKER_CLASS = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')  # 'gthread' or 'gevent'
+    GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+    WARM_UP_ON_START = os.environ.get('WARM_UP_ON_START', 'True').lower() in ('true', '1', 't')  # see warmup.py
+
     # Database settings
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Connection pool per worker process: one connection per thread, a few extra for bursts,
+    # checked before use and replaced before the server or a proxy drops it
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', GUNICORN_THREADS))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 5))
+    DATABASE_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT', 10))  # seconds to wait for a connection
+    DATABASE_POOL_PRE_PING = os.environ.get('DATABASE_POOL_PRE_PING', 'True').lower() in ('true', '1', 't')
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))  # seconds
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI, DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW,
+        DATABASE_POOL_TIMEOUT, DATABASE_POOL_PRE_PING, DATABASE_POOL_RECYCLE
+    )
+
+    # Optional read replica for the read-only pages (see replica.py). After a user writes,
+    # their reads stay on the primary for DATABASE_REPLICA_STICKY_SECONDS to hide replica lag
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS', 5))
+    SQLALCHEMY_BINDS = {
+        'replica': dict(engine_options(
+            DATABASE_REPLICA_URL, DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW,
+            DATABASE_POOL_TIMEOUT, DATABASE_POOL_PRE_PING, DATABASE_POOL_RECYCLE
+        ), url=DATABASE_REPLICA_URL)
+    } if DATABASE_REPLICA_URL else {}
+
     # API keys
     RESEND_API_KEY = os.environ.get('RESEND_API_KEY')
     CURRENCY_API_KEY = os.environ.get('CURRENCY_API_KEY')
 
+    # Email outbox worker
+    OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 4))
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 500))
+    OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))  # seconds
+
+    # Exchange rate cache shared by all workers on the host
+    EXCHANGE_RATE_TTL = int(os.environ.get('EXCHANGE_RATE_TTL', 3600))  # seconds
+    EXCHANGE_RATE_CACHE_PATH = os.environ.get(
+        'EXCHANGE_RATE_CACHE_PATH',
+        os.path.join(tempfile.gettempdir(), 'expensesplitter_rates.sqlite3')
+    )
+
+    # Settlement solver: exact minimum-transfer search for small groups, greedy otherwise
+    SETTLEMENT_EXACT_MAX_MEMBERS = int(os.environ.get('SETTLEMENT_EXACT_MAX_MEMBERS', 12))
+    SETTLEMENT_TIME_BUDGET_MS = int(os.environ.get('SETTLEMENT_TIME_BUDGET_MS', 50))
+    SETTLEMENT_MAX_ITERATIONS = int(os.environ.get('SETTLEMENT_MAX_ITERATIONS', 200000))
+
+    # Expense list pagination
+    EXPENSE_PAGE_SIZE = int(os.environ.get('EXPENSE_PAGE_SIZE', 50))
+    EXPENSE_PAGE_SIZE_MAX = int(os.environ.get('EXPENSE_PAGE_SIZE_MAX', 200))
+
+    # Bulk import: rows validated and inserted per transaction, and the most rows read per file
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+    IMPORT_MAX_ROWS = int(os.environ.get('IMPORT_MAX_ROWS', 50000))
+
+    # Newest unread notifications shown as toasts on every page
+    NOTIFICATION_BADGE_LIMIT = int(os.environ.get('NOTIFICATION_BADGE_LIMIT', 5))
+
+    # Notification history: page size, and retention for the prune-notifications command.
+    # Read notifications older than the retention period, or beyond each user's newest
+    # NOTIFICATION_HISTORY_LIMIT read ones, are deleted; unread ones are always kept
+    NOTIFICATION_PAGE_SIZE = int(os.environ.get('NOTIFICATION_PAGE_SIZE', 30))
+    NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+    NOTIFICATION_HISTORY_LIMIT = int(os.environ.get('NOTIFICATION_HISTORY_LIMIT', 500))
+
+    # Notification stream (Server-Sent Events). Signals reach streams in other workers
+    # through a SQLite file shared on the host; set the path empty for in-process only
+    NOTIFICATION_STREAM_ENABLED = os.environ.get('NOTIFICATION_STREAM_ENABLED', 'True').lower() in ('true', '1', 't')
+    NOTIFICATION_STREAM_TIMEOUT = int(os.environ.get('NOTIFICATION_STREAM_TIMEOUT', 120))  # seconds before the client reconnects
+    NOTIFICATION_STREAM_HEARTBEAT = int(os.environ.get('NOTIFICATION_STREAM_HEARTBEAT', 15))  # seconds
+    # Streams per worker process. Under gthread each open stream holds a thread, so by default
+    # they may take at most half of them; under gevent a stream is just a greenlet
+    NOTIFICATION_STREAM_MAX_CLIENTS = int(os.environ.get(
+        'NOTIFICATION_STREAM_MAX_CLIENTS',
+        100 if GUNICORN_WORKER_CLASS == 'gevent' else max(1, GUNICORN_THREADS // 2)
+    ))
+    NOTIFICATION_SIGNAL_PATH = os.environ.get(
+        'NOTIFICATION_SIGNAL_PATH',
+        os.path.join(tempfile.gettempdir(), 'expensesplitter_notifications.sqlite3')
+    )
+    NOTIFICATION_SIGNAL_POLL_INTERVAL = float(os.environ.get('NOTIFICATION_SIGNAL_POLL_INTERVAL', 1))  # seconds
+
+    # Logged-in users cached per worker process (see user_cache.py); a TTL of 0 disables it
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))  # seconds
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+
+    # Logging (see logs.py): level, 'json' or 'text' lines, and the fraction of DEBUG/INFO
+    # records and of access log lines kept. Warnings and errors are always kept
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO').upper()
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+    LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+    LOG_ACCESS_SAMPLE_RATE = float(os.environ.get('LOG_ACCESS_SAMPLE_RATE', 0.1))
+
+    # Metrics: add X-Query-Count headers outside debug mode, and the bearer token for /metrics
+    # (the endpoint returns 404 while no token is set)
+    METRICS_QUERY_HEADER = os.environ.get('METRICS_QUERY_HEADER', 'False').lower() in ('true', '1', 't')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
     # Other settings
     # ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
@@ -0,0 +1,88 @@
+"""
+Conditional GET support for the group pages and the balance-data API.
+
+A group's ETag is derived from its version counter (see utils.bump_group_version)
+plus everything else the response depends on: the user, the query string, the
+exchange rates and the deployed templates. A request whose If-None-Match still
+matches gets a 304 before any expenses are loaded or balances computed.
+"""
+
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+from flask import Response, current_app, request, session
+from sqlalchemy import func
+
+from models import db, Notification
+from utils import get_exchange_rates
+
+def template_version():
+    """Latest modification time of the templates, so a deploy invalidates cached pages."""
+    template_dir = os.path.join(current_app.root_path, current_app.template_folder)
+    if current_app.jinja_env.auto_reload:
+        # Templates may change while the app runs
+        return _latest_mtime(template_dir)
+    return _cached_latest_mtime(template_dir)
+
+def _latest_mtime(directory):
+    latest = 0
+    for path, _, filenames in os.walk(directory):
+        for filename in filenames:
+            latest = max(latest, os.path.getmtime(os.path.join(path, filename)))
+    return str(latest)
+
+_cached_latest_mtime = lru_cache(maxsize=1)(_latest_mtime)
+
+def unread_state(user_id):
+    """The user's unread notification count and newest unread timestamp, which every page's navigation bar shows."""
+    count, newest = db.session.query(func.count(), func.max(Notification.created_at)).filter(
+        Notification.user_id == user_id,
+        Notification.read == False
+    ).one()
+    return count, newest.isoformat() if newest else None
+
+def group_etag(group, user, display_currency, page=True):
+    """
+    Build the strong ETag for a group response.
+
+    Args:
+        group: The Group, with its current version
+        user: The current user
+        display_currency: Currency the balances are shown in, or None
+        page: Whether the response is a full HTML page (adds the parts of the layout
+            that change independently of the group)
+
+    Returns:
+        The ETag value, without quotes
+    """
+    parts = [
+        group.id,
+        group.version,
+        user.id,
+        display_currency,
+        request.full_path,
+        json.dumps(get_exchange_rates(), sort_keys=True),
+    ]
+    if page:
+        parts += [user.username, template_version(), unread_state(user.id)]
+
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+def not_modified(etag, page=True):
+    """
+    Get a 304 response if the client already has this version, else None.
+    Pages with pending flash messages are always rendered.
+    """
+    if etag not in request.if_none_match or (page and '_flashes' in session):
+        return None
+
+    response = Response(status=304)
+    return with_etag(response, etag)
+
+def with_etag(response, etag):
+    """Set the ETag on a response and make clients revalidate it on every use."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
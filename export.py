@@ -0,0 +1,121 @@
+"""
+Streaming CSV export of a group's expenses, balances and settlement plan.
+
+Expenses are read as plain rows in batches from a streaming cursor and written
+out as soon as each batch is formatted, so memory use stays flat however large
+the group is and the first bytes reach the client right away.
+"""
+
+import csv
+import json
+
+from sqlalchemy import select
+
+from models import db, User, Expense, expense_participants
+from utils import get_ledger_balances, get_settlement_plan
+
+EXPORT_BATCH_SIZE = 500
+
+EXPENSE_COLUMNS = ['Date', 'Description', 'Amount', 'Currency', 'Paid By', 'Participants', 'Split Type', 'Splits']
+
+class _Echo:
+    """File-like object whose write() returns the line, so csv.writer can format single rows."""
+
+    def write(self, value):
+        return value
+
+class _NameResolver:
+    """Usernames from the member map, with one query per batch for anyone who left the group."""
+
+    def __init__(self, members_by_id):
+        self.names = {user_id: member.username for user_id, member in members_by_id.items()}
+
+    def load(self, user_ids):
+        missing = set(user_ids) - set(self.names)
+        if missing:
+            self.names.update(db.session.query(User.id, User.username).filter(User.id.in_(missing)).all())
+            for user_id in missing:
+                self.names.setdefault(user_id, "Unknown")
+
+    def get(self, user_id):
+        return self.names.get(user_id, "Unknown")
+
+def _split_type(custom_splits):
+    return 'Custom' if custom_splits and json.loads(custom_splits) else 'Equal'
+
+def _splits(custom_splits, names):
+    """Custom split percentages as "name: percentage; ...", the format the importer reads."""
+    if not custom_splits:
+        return ''
+    return '; '.join(f"{names.get(user_id)}: {percentage}" for user_id, percentage in json.loads(custom_splits).items())
+
+def generate_group_csv(snapshot, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Generate the CSV export for a group, one chunk of text per batch of expenses.
+
+    Args:
+        snapshot: GroupSnapshot with the group's members (expenses are not needed)
+        batch_size: Number of expenses to read and write at a time
+
+    Yields:
+        Chunks of CSV text
+    """
+    group_id = snapshot.group.id
+    writer = csv.writer(_Echo())
+    names = _NameResolver(snapshot.members_by_id)
+
+    # Write header
+    yield writer.writerow(EXPENSE_COLUMNS)
+
+    # Write expenses, reading them as rows from a streaming cursor so nothing
+    # accumulates in the session
+    statement = select(
+        Expense.id, Expense.date, Expense.description, Expense.amount,
+        Expense.currency, Expense.payer, Expense.custom_splits
+    ).where(
+        Expense.group_id == group_id
+    ).order_by(
+        Expense.date, Expense.id
+    ).execution_options(yield_per=batch_size)
+
+    for batch in db.session.execute(statement).partitions():
+        # Get the participants of the whole batch in one query
+        participants = {}
+        for expense_id, user_id in db.session.execute(
+            select(expense_participants.c.expense_id, expense_participants.c.user_id).where(
+                expense_participants.c.expense_id.in_([row.id for row in batch])
+            )
+        ):
+            participants.setdefault(expense_id, []).append(user_id)
+
+        names.load({row.payer for row in batch} | {user_id for ids in participants.values() for user_id in ids})
+
+        lines = []
+        for row in batch:
+            lines.append(writer.writerow([
+                row.date.strftime('%Y-%m-%d'),
+                row.description,
+                row.amount,
+                row.currency,
+                names.get(row.payer),
+                ', '.join(names.get(user_id) for user_id in participants.get(row.id, [])),
+                _split_type(row.custom_splits),
+                _splits(row.custom_splits, names)
+            ]))
+        yield ''.join(lines)
+
+    # Calculate balances and add to CSV
+    balances = get_ledger_balances(group_id, snapshot.members)
+    lines = [writer.writerow([]), writer.writerow(['Balances']), writer.writerow(['User', 'Net Balance'])]
+    for user_id, balance in balances.items():
+        lines.append(writer.writerow([snapshot.username(user_id), balance]))
+
+    # Add settlement plan
+    lines += [writer.writerow([]), writer.writerow(['Settlement Plan']), writer.writerow(['From', 'To', 'Amount'])]
+    for settlement in get_settlement_plan(balances):
+        lines.append(writer.writerow([
+            snapshot.username(settlement['from']),
+            snapshot.username(settlement['to']),
+            settlement['amount']
+        ]))
+    yield ''.join(lines)
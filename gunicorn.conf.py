@@ -0,0 +1,137 @@
+"""
+Gunicorn configuration for production.
+
+Gunicorn picks this file up automatically from the working directory, so the
+container just runs `gunicorn main:app`. Every setting can be overridden with
+the environment variables below, or on the gunicorn command line.
+
+Worker model
+------------
+GUNICORN_WORKER_CLASS selects how each worker process handles requests:
+
+- gthread (default): each worker runs a pool of GUNICORN_THREADS threads. A
+  request blocked on the currency API, Resend or the database only holds its
+  own thread. Nothing beyond gunicorn needs to be installed.
+- gevent: each worker runs up to GUNICORN_WORKER_CONNECTIONS greenlets, and the
+  standard library is monkey-patched so blocking I/O yields. This suits many
+  long-lived notification streams. It requires `pip install gevent`, and
+  psycogreen for PostgreSQL, since psycopg2 would otherwise block the whole
+  worker.
+
+Workers default to the number of CPUs the container may use, including cgroup
+CPU quotas, so throughput scales with the cores given to the container.
+
+preload_app
+-----------
+The application is imported once in the master process and the workers are
+forked from it. This shares memory and surfaces import errors before any
+worker starts. Importing the app opens no connections (the schema is managed
+by `flask --app main migrate`), but any connection the master did open would
+be copied into every worker. post_fork therefore disposes each worker's copy
+of the engine pools without closing the parent's sockets, so each worker opens
+its own connections on first use.
+
+Warm-up
+-------
+Unless WARM_UP_ON_START is off, each worker loads the exchange rates and
+compiles the templates (see warmup.py) before it accepts traffic.
+
+Database sessions
+-----------------
+Flask-SQLAlchemy scopes db.session to the application context. Every request
+gets its own context, and so its own session, whether it runs on a thread or a
+greenlet. Sessions are never shared between concurrent requests. At the end
+of the request, Flask-SQLAlchemy removes the session and its connection goes
+back to the worker's pool. A worker therefore needs at most one connection per
+request it serves at once. That is GUNICORN_THREADS under gthread, which is
+what DATABASE_POOL_SIZE defaults to; under gevent, raise DATABASE_POOL_SIZE or
+DATABASE_MAX_OVERFLOW to match the expected concurrency. With a read replica,
+each worker keeps a second pool of the same size. Long-lived notification
+streams release their session between polls, and under gthread they are
+limited to half the threads (see NOTIFICATION_STREAM_MAX_CLIENTS in
+config.py). Module-level state that threads may touch, like the rate cache
+and the notification hub, is locked. Such state is created lazily in each
+worker, never in the master.
+"""
+
+import os
+
+def available_cpus():
+    """CPUs this process may use: the affinity mask, capped by a cgroup v2 CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return cpus
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+# Load .env the same way the application does
+from config import Config  # noqa: E402
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 8080)}")
+
+worker_class = Config.GUNICORN_WORKER_CLASS
+workers = _env_int('GUNICORN_WORKERS', available_cpus())
+threads = Config.GUNICORN_THREADS  # gthread only
+worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 1000)  # gevent only
+
+timeout = _env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+# Recycle workers now and then so slow leaks can't build up
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 10000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', 1000)
+
+preload_app = True
+
+# The app writes its own sampled, JSON access log (see logs.py), off the request
+# thread. Set GUNICORN_ACCESS_LOG=- to also get gunicorn's unsampled one
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+if worker_class == 'gevent':
+    # Patch before the application (and with it ssl, socket and threading) is preloaded
+    from gevent import monkey
+    monkey.patch_all()
+
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+def post_fork(server, worker):
+    """Drop the database connections inherited from the master without closing them."""
+    from app import app
+    from models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    server.log.info("Worker %s ready (%s, %s threads)", worker.pid, worker_class, threads)
+
+def post_worker_init(worker):
+    """Warm the worker up before it starts accepting connections."""
+    if Config.WARM_UP_ON_START:
+        from app import app
+        from warmup import warm_up
+        warm_up(app)
+
+def worker_exit(server, worker):
+    """Write out queued log records; workers exit without running atexit handlers."""
+    import logs
+    logs.shutdown()
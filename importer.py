@@ -0,0 +1,362 @@
+"""
+Bulk expense import.
+
+Accepts CSV in the columns written by the CSV export (Date, Description, Amount,
+Currency, Paid By, Participants, Split Type, plus an optional Splits column for
+custom percentages such as "alice: 30; bob: 70") or JSON Lines with the same
+fields in snake_case. Rows are validated and written in chunks: each chunk's
+expenses, participant links and shares are inserted with one multi-row INSERT per
+table, the balance ledger is updated once per chunk, and every row that fails
+validation is reported with its line number instead of aborting the import.
+"""
+
+import csv
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import insert
+
+from models import db, Expense, ExpenseShare, expense_participants
+from money import to_minor
+from utils import add_notifications, apply_ledger_deltas, get_exchange_rates
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_AMOUNT = Decimal(10) ** 12
+
+# CSV headers (as written by the export) and the field names they map to
+CSV_FIELDS = {
+    'date': 'date',
+    'description': 'description',
+    'amount': 'amount',
+    'currency': 'currency',
+    'paid by': 'paid_by',
+    'participants': 'participants',
+    'split type': 'split_type',
+    'splits': 'splits',
+}
+
+class ImportFormatError(Exception):
+    """Raised when the uploaded file can't be read as the requested format."""
+
+def read_csv_rows(stream):
+    """
+    Read CSV records from a text stream. Reading stops at the first empty row, so a
+    complete export file (which ends with balance and settlement sections) can be
+    imported as is.
+
+    Yields:
+        Tuples (line_number, record)
+    """
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if not header:
+        raise ImportFormatError("The file is empty.")
+
+    fields = [CSV_FIELDS.get(column.strip().lower()) for column in header]
+    if 'amount' not in fields or 'paid_by' not in fields:
+        raise ImportFormatError("The CSV header must include at least the Amount and Paid By columns.")
+
+    for row in reader:
+        if not any(value.strip() for value in row):
+            break
+        yield reader.line_num, {field: value for field, value in zip(fields, row) if field}
+
+def read_jsonl_rows(stream):
+    """
+    Read JSON Lines records from a text stream; blank lines are skipped.
+
+    Yields:
+        Tuples (line_number, record); records that aren't valid JSON objects are
+        yielded as error strings
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, "Each line must be a JSON object"
+            continue
+        yield line_number, record
+
+def detect_format(requested=None, filename=None, content_type=None):
+    """
+    Work out whether an upload is CSV or JSON Lines.
+
+    Args:
+        requested: Format chosen by the user ('csv', 'jsonl' or 'auto')
+        filename: Name of the uploaded file
+        content_type: Content type of the upload
+
+    Returns:
+        'csv' or 'jsonl'
+    """
+    requested = (requested or 'auto').lower()
+    if requested in ('csv', 'jsonl'):
+        return requested
+    if requested != 'auto':
+        raise ImportFormatError(f"Unknown import format '{requested}'.")
+
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    if content_type and ('json' in content_type.lower()):
+        return 'jsonl'
+    return 'csv'
+
+def read_records(stream, file_format):
+    """Read (line_number, record) tuples from a text stream in the given format."""
+    if file_format == 'jsonl':
+        return read_jsonl_rows(stream)
+    return read_csv_rows(stream)
+
+def _parse_names(value):
+    if isinstance(value, list):
+        return [str(name).strip() for name in value if str(name).strip()]
+    return [name.strip() for name in str(value or '').split(',') if name.strip()]
+
+def _parse_splits(value):
+    """Parse custom splits from a dictionary or a "name: percentage; ..." string."""
+    if isinstance(value, dict):
+        return {str(name).strip(): percentage for name, percentage in value.items()}
+
+    splits = {}
+    for part in str(value or '').split(';'):
+        if not part.strip():
+            continue
+        name, _, percentage = part.partition(':')
+        splits[name.strip()] = percentage.strip()
+    return splits
+
+def validate_record(record, members_by_name, currencies):
+    """
+    Validate one import record against the group's members.
+
+    Args:
+        record: Dictionary of raw field values
+        members_by_name: Dictionary mapping username to member User
+        currencies: Currency codes that have an exchange rate, as offered by the add-expense form
+
+    Returns:
+        A tuple (values, errors); values is None when there are errors
+    """
+    errors = []
+
+    # Date
+    date = None
+    date_value = str(record.get('date') or '').strip()
+    if not date_value:
+        errors.append("Date is required")
+    else:
+        try:
+            date = datetime.strptime(date_value, '%Y-%m-%d')
+        except ValueError:
+            try:
+                date = datetime.fromisoformat(date_value)
+            except ValueError:
+                errors.append(f"Invalid date '{date_value}' (expected YYYY-MM-DD)")
+
+    # Description
+    description = str(record.get('description') or '').strip()
+    if not description:
+        errors.append("Description is required")
+    elif len(description) > 200:
+        errors.append("Description is longer than 200 characters")
+
+    # Amount
+    amount = None
+    try:
+        amount = Decimal(str(record.get('amount')).strip())
+        if not amount.is_finite() or amount <= 0:
+            errors.append("Amount must be a positive number")
+        elif amount >= MAX_AMOUNT:
+            errors.append("Amount is too large")
+    except (InvalidOperation, ValueError):
+        errors.append(f"Invalid amount '{record.get('amount')}'")
+
+    # Currency
+    currency = str(record.get('currency') or 'USD').strip().upper()
+    if currency not in currencies:
+        errors.append(f"Unknown currency '{currency}'")
+
+    # Payer
+    payer_name = str(record.get('paid_by') or record.get('payer') or '').strip()
+    payer = members_by_name.get(payer_name)
+    if payer is None:
+        errors.append(f"Payer '{payer_name}' is not a member of the group" if payer_name else "Paid By is required")
+
+    # Participants
+    participant_ids = []
+    names = _parse_names(record.get('participants'))
+    if not names:
+        errors.append("At least one participant is required")
+    for name in dict.fromkeys(names):
+        member = members_by_name.get(name)
+        if member is None:
+            errors.append(f"Participant '{name}' is not a member of the group")
+        else:
+            participant_ids.append(member.id)
+
+    # Split
+    custom_splits = None
+    split_type = str(record.get('split_type') or 'equal').strip().lower()
+    if split_type == 'custom':
+        splits = _parse_splits(record.get('splits'))
+        if not splits:
+            errors.append("Custom split percentages are missing (use the Splits column, e.g. \"alice: 60; bob: 40\")")
+        else:
+            custom_splits = {}
+            for name, percentage in splits.items():
+                member = members_by_name.get(name)
+                if member is None or member.id not in participant_ids:
+                    errors.append(f"Split for '{name}', who is not a participant")
+                    continue
+                try:
+                    custom_splits[member.id] = float(percentage)
+                except (TypeError, ValueError):
+                    errors.append(f"Invalid percentage '{percentage}' for '{name}'")
+
+            # Same check as the add expense form
+            if sum(custom_splits.values()) != 100:
+                errors.append("Custom split percentages must add up to 100%")
+    elif split_type != 'equal':
+        errors.append(f"Invalid split type '{record.get('split_type')}' (expected Equal or Custom)")
+
+    if errors:
+        return None, errors
+
+    return {
+        'date': date,
+        'description': description,
+        'amount': amount,
+        'currency': currency,
+        'payer': payer.id,
+        'participant_ids': participant_ids,
+        'custom_splits': custom_splits,
+    }, []
+
+def _write_chunk(group_id, chunk):
+    """
+    Insert a chunk of validated rows with one multi-row INSERT per table and
+    update the balance ledger once for the whole chunk.
+    """
+    now = datetime.now()
+    expense_rows = []
+    participant_rows = []
+    share_rows = []
+    deltas = {}
+
+    for values in chunk:
+        expense_id = str(uuid.uuid4())
+        amount_minor = to_minor(values['amount'], values['currency'])
+
+        expense_rows.append({
+            'id': expense_id,
+            'group_id': group_id,
+            'amount': float(values['amount']),
+            'amount_minor': amount_minor,
+            'description': values['description'],
+            'date': values['date'],
+            'payer': values['payer'],
+            'currency': values['currency'],
+            'custom_splits': json.dumps(values['custom_splits']) if values['custom_splits'] else None,
+            'created_at': now,
+            'settled': False,
+        })
+        participant_rows.extend(
+            {'expense_id': expense_id, 'user_id': user_id} for user_id in values['participant_ids']
+        )
+
+        owed = Expense.split_amount(amount_minor, values['participant_ids'], values['custom_splits'])
+        share_rows.extend(
+            {'expense_id': expense_id, 'user_id': user_id, 'share_amount': share} for user_id, share in owed.items()
+        )
+        for user_id, amount in Expense.net_shares(amount_minor, values['payer'], owed).items():
+            key = (user_id, values['currency'])
+            deltas[key] = deltas.get(key, 0) + amount
+
+    db.session.execute(insert(Expense), expense_rows)
+    db.session.execute(insert(expense_participants), participant_rows)
+    db.session.execute(insert(ExpenseShare), share_rows)
+    apply_ledger_deltas(group_id, deltas)
+
+def import_expenses(snapshot, records, imported_by, group_link=None, chunk_size=IMPORT_CHUNK_SIZE, max_rows=None):
+    """
+    Validate and insert expenses for a group, committing one chunk at a time.
+
+    Args:
+        snapshot: GroupSnapshot of the group with its members
+        records: Iterable of (line_number, record) tuples from read_records
+        imported_by: The User running the import
+        group_link: Link to the group for the notifications
+        chunk_size: Number of rows to validate and insert per transaction
+        max_rows: Optional maximum number of rows to read
+
+    Returns:
+        A dictionary with the number of rows read and imported, the per-row errors
+        and the IDs of the members who were notified
+    """
+    members_by_name = {member.username: member for member in snapshot.members}
+    currencies = set(get_exchange_rates())
+    group_id = snapshot.group.id
+
+    report = {'rows': 0, 'imported': 0, 'errors': [], 'notified': []}
+    affected = set()
+    chunk = []
+
+    def flush():
+        if chunk:
+            _write_chunk(group_id, chunk)
+            db.session.commit()
+            report['imported'] += len(chunk)
+            chunk.clear()
+
+    records = iter(records)
+    while True:
+        try:
+            line_number, record = next(records)
+        except StopIteration:
+            break
+        except (csv.Error, UnicodeDecodeError) as e:
+            # Keep what was imported so far and report where reading stopped
+            report['errors'].append({'line': None, 'errors': [f"Stopped reading the file after {report['rows']} rows: {e}"]})
+            break
+
+        if max_rows is not None and report['rows'] >= max_rows:
+            report['errors'].append({'line': line_number, 'errors': [f"Import is limited to {max_rows} rows; the rest was skipped"]})
+            break
+        report['rows'] += 1
+
+        if isinstance(record, str):
+            report['errors'].append({'line': line_number, 'errors': [record]})
+            continue
+
+        values, errors = validate_record(record, members_by_name, currencies)
+        if errors:
+            report['errors'].append({'line': line_number, 'errors': errors})
+            continue
+
+        chunk.append(values)
+        affected.update(values['participant_ids'])
+        if len(chunk) >= chunk_size:
+            flush()
+
+    flush()
+
+    # One notification per member involved, however many rows mention them
+    notified = sorted(affected - {imported_by.id})
+    if report['imported'] and notified:
+        add_notifications(
+            notified,
+            title=f"Expenses Imported in {snapshot.group.name}",
+            message=f"{imported_by.username} imported {report['imported']} expense{'s' if report['imported'] != 1 else ''}",
+            link=group_link
+        )
+        db.session.commit()
+        report['notified'] = notified
+
+    return report
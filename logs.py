@@ -0,0 +1,218 @@
+"""
+Logging setup.
+
+Every record is handed to a queue and written by a background thread (a
+QueueListener), so a request thread never waits on stdout. Records are written
+one JSON object per line, with the id of the request that logged them, or as
+plain text for local development (LOG_FORMAT=text).
+
+High-volume records are sampled: DEBUG and INFO records are kept with
+probability LOG_SAMPLE_RATE, and the per-request access log with
+LOG_ACCESS_SAMPLE_RATE. Warnings and errors are always kept. Within a request
+the decision is made once per request id, so a sampled request keeps all of its
+lines. Kept records carry their sample rate so counts can be scaled back up.
+
+A request's id is taken from the X-Request-ID header when the client or load
+balancer sends one, otherwise generated, and returned in the response.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+access_logger = logging.getLogger('access')
+
+# Libraries that log every connection or statement at DEBUG/INFO
+QUIET_LOGGERS = ('urllib3', 'sqlalchemy')
+
+# Incoming request ids are logged and echoed back, so only accept plain tokens
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._:/-]{1,128}')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime', 'request_id', 'sample_rate', 'taskName',
+}
+
+_queue_handler = None
+_listener = None
+
+def current_request_id():
+    """Get the current request's id, or None outside a request."""
+    if not has_request_context():
+        return None
+    return g.get('request_id')
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as a single line of JSON."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'sample_rate', 1.0) < 1.0:
+            entry['sample_rate'] = record.sample_rate
+
+        # Fields passed with extra=
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+
+        return json.dumps(entry, default=str)
+
+class ContextFilter(logging.Filter):
+    """
+    Tag records with the current request id and drop the ones not sampled.
+    Runs on the logging thread, since the request context isn't available on the
+    listener thread.
+    """
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        record.request_id = current_request_id()
+
+        if record.levelno >= logging.WARNING:
+            return True
+
+        # A record may ask for its own rate with extra={'sample_rate': ...}
+        rate = getattr(record, 'sample_rate', self.sample_rate)
+        record.sample_rate = rate
+        if rate >= 1.0:
+            return True
+        return _sample(record.request_id, rate)
+
+def _sample(request_id, rate):
+    """Decide whether to keep a record, the same way for every record of a request."""
+    if request_id is None:
+        return random.random() < rate
+    return zlib.crc32(request_id.encode('utf-8')) / 0xFFFFFFFF < rate
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Put records on the queue with their message and traceback rendered, but leave
+    the JSON formatting (and all the I/O) to the listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def _output_handler(log_format):
+    handler = logging.StreamHandler()
+    if log_format == 'text':
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        handler.setFormatter(JsonFormatter())
+    return handler
+
+def _start_listener(log_format):
+    """Start a listener thread writing from a fresh queue."""
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, _output_handler(log_format))
+    _listener.start()
+
+def shutdown():
+    """Write out whatever is still queued and stop the listener. Runs at exit."""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+def configure(config):
+    """
+    Route all logging through the queue. Safe to call more than once; only the
+    first call has an effect.
+
+    Args:
+        config: The Config class (LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE)
+    """
+    global _queue_handler
+    if _queue_handler is not None:
+        return
+
+    _queue_handler = _QueueHandler(None)
+    _queue_handler.addFilter(ContextFilter(config.LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(config.LOG_LEVEL)
+
+    if config.LOG_LEVEL != 'DEBUG':
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    _start_listener(config.LOG_FORMAT)
+    atexit.register(shutdown)
+
+    # Threads don't survive a fork, so a forked worker (gunicorn preloads the app
+    # in its master) needs its own listener, and a queue no other process holds a lock on
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: _start_listener(config.LOG_FORMAT))
+
+def _start_request():
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if REQUEST_ID_PATTERN.fullmatch(request_id) else uuid.uuid4().hex
+    g._log_started = time.perf_counter()
+
+def _finish_request(response, sample_rate):
+    if 'request_id' not in g:
+        return response
+
+    response.headers['X-Request-ID'] = g.request_id
+    duration_ms = round((time.perf_counter() - g._log_started) * 1000, 1)
+
+    # Server errors are logged at ERROR, so they are never sampled out
+    level = logging.ERROR if response.status_code >= 500 else logging.INFO
+    access_logger.log(
+        level, "%s %s %s", request.method, request.path, response.status_code,
+        extra={
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': duration_ms,
+            'sample_rate': sample_rate,
+        }
+    )
+    return response
+
+def init_app(app):
+    """Give every request an id and write a sampled access log line for it."""
+    sample_rate = app.config['LOG_ACCESS_SAMPLE_RATE']
+
+    app.before_request(_start_request)
+    app.after_request(lambda response: _finish_request(response, sample_rate))
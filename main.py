@@ -1,11 +1,9 @@
 import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
 
+# The .env file is loaded once, by config.py
 from app import app
 import routes  # noqa: F401
+import commands  # noqa: F401
 
 if __name__ == '__main__':
     debug = os.environ.get('DEBUG', 'False').lower() in ('true', '1', 't')
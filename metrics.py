@@ -0,0 +1,197 @@
+"""
+Per-request instrumentation.
+
+Records, for every endpoint, the request count and latency, the number of SQL
+statements and the time spent in the database, and the time spent rendering
+templates. External calls (exchange rates, email) are timed as spans. Everything
+is kept in process memory and served in the Prometheus text format at /metrics;
+with several workers each process reports its own numbers.
+"""
+
+import functools
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+class Counter:
+    """A counter with labels."""
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    """A histogram with labels and fixed buckets."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, label_values, value):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+_lock = threading.Lock()
+
+REQUESTS = Counter('http_requests_total', 'Requests handled.', ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time spent handling a request.',
+                            ('endpoint',), LATENCY_BUCKETS)
+DB_QUERIES = Histogram('db_queries_per_request', 'SQL statements executed per request.',
+                       ('endpoint',), QUERY_COUNT_BUCKETS)
+DB_SECONDS = Histogram('db_duration_seconds_per_request', 'Time spent in the database per request.',
+                       ('endpoint',), LATENCY_BUCKETS)
+TEMPLATE_SECONDS = Histogram('template_render_duration_seconds', 'Time spent rendering templates per request.',
+                             ('endpoint',), LATENCY_BUCKETS)
+EXTERNAL_SECONDS = Histogram('external_call_duration_seconds', 'Time spent in calls to external services.',
+                             ('span',), LATENCY_BUCKETS)
+EXTERNAL_ERRORS = Counter('external_call_errors_total', 'External calls that raised an exception.', ('span',))
+
+ALL_METRICS = (REQUESTS, REQUEST_SECONDS, DB_QUERIES, DB_SECONDS, TEMPLATE_SECONDS,
+               EXTERNAL_SECONDS, EXTERNAL_ERRORS)
+
+def _stats():
+    """Get the current request's stats, or None outside a request."""
+    if not has_request_context():
+        return None
+    return g.get('_metrics')
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['_metrics_started'] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('_metrics_started', None)
+    stats = _stats()
+    if stats is not None and started is not None:
+        stats['queries'] += 1
+        stats['db_time'] += time.perf_counter() - started
+
+def _before_render_template(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None:
+        stats['template_started'].append(time.perf_counter())
+
+def _template_rendered(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None and stats['template_started']:
+        stats['template_time'] += time.perf_counter() - stats['template_started'].pop()
+
+def _start_request():
+    g._metrics = {
+        'started': time.perf_counter(),
+        'queries': 0,
+        'db_time': 0.0,
+        'template_time': 0.0,
+        'template_started': [],
+    }
+
+def _finish_request(response):
+    stats = _stats()
+    if stats is None:
+        return response
+
+    endpoint = request.endpoint or 'unmatched'
+    elapsed = time.perf_counter() - stats['started']
+    with _lock:
+        REQUESTS.inc((endpoint, request.method, str(response.status_code)))
+        REQUEST_SECONDS.observe((endpoint,), elapsed)
+        DB_QUERIES.observe((endpoint,), stats['queries'])
+        DB_SECONDS.observe((endpoint,), stats['db_time'])
+        TEMPLATE_SECONDS.observe((endpoint,), stats['template_time'])
+
+    if current_app.config.get('METRICS_QUERY_HEADER') or current_app.debug:
+        response.headers['X-Query-Count'] = str(stats['queries'])
+        response.headers['X-DB-Time-Ms'] = f"{stats['db_time'] * 1000:.1f}"
+    return response
+
+def init_app(app):
+    """
+    Start collecting metrics for app. The X-Query-Count header is added when
+    METRICS_QUERY_HEADER is set or the app runs in debug mode.
+    """
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+def span(name):
+    """
+    Decorator that times calls to an external service under the given span name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = False
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                with _lock:
+                    EXTERNAL_SECONDS.observe((name,), elapsed)
+                    if failed:
+                        EXTERNAL_ERRORS.inc((name,))
+        return wrapper
+    return decorator
+
+def render_metrics():
+    """Render every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for metric in ALL_METRICS:
+            lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
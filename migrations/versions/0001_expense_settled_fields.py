@@ -0,0 +1,21 @@
+"""
+Add the settled, settled_at and settled_by columns to the expense table.
+Replaces the former migrations/add_settled_fields.py script and does nothing on databases that already ran it.
+"""
+
+from sqlalchemy import text
+
+from migrator import has_column
+
+def upgrade(connection):
+    postgresql = connection.dialect.name == 'postgresql'
+
+    if not has_column(connection, 'expense', 'settled'):
+        default = 'FALSE' if postgresql else '0'
+        connection.execute(text(f"ALTER TABLE expense ADD COLUMN settled BOOLEAN DEFAULT {default}"))
+
+    if not has_column(connection, 'expense', 'settled_at'):
+        connection.execute(text("ALTER TABLE expense ADD COLUMN settled_at TIMESTAMP"))
+
+    if not has_column(connection, 'expense', 'settled_by'):
+        connection.execute(text('ALTER TABLE expense ADD COLUMN settled_by VARCHAR(120) REFERENCES "user"(id)'))
@@ -0,0 +1,46 @@
+"""
+Store expense amounts as integer minor units: add and backfill expense.amount_minor,
+and recreate the balance_ledger table if it still holds float balances.
+Replaces the former migrations/add_amount_minor.py script and does nothing on databases that already ran it.
+"""
+
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, MetaData, String, Table, text
+
+from migrator import has_column
+from money import to_minor
+
+BATCH_SIZE = 1000
+
+def upgrade(connection):
+    if not has_column(connection, 'expense', 'amount_minor'):
+        connection.execute(text("ALTER TABLE expense ADD COLUMN amount_minor BIGINT"))
+
+    rows = connection.execute(text("SELECT id, amount, currency FROM expense WHERE amount_minor IS NULL")).all()
+    update = text("UPDATE expense SET amount_minor = :amount_minor WHERE id = :id")
+    for start in range(0, len(rows), BATCH_SIZE):
+        connection.execute(update, [
+            {'id': expense_id, 'amount_minor': to_minor(amount, currency or 'USD')}
+            for expense_id, amount, currency in rows[start:start + BATCH_SIZE]
+        ])
+
+    # The ledger is derived data; `flask --app main migrate` rebuilds each group's ledger afterwards
+    if has_column(connection, 'balance_ledger', 'net_amount'):
+        connection.execute(text("DROP TABLE balance_ledger"))
+        balance_ledger_table().create(connection)
+
+def balance_ledger_table():
+    """The balance_ledger table as this migration creates it, independent of later model changes."""
+    metadata = MetaData()
+
+    # Referenced tables, only so the foreign keys resolve; they aren't created
+    Table('group', metadata, Column('id', String(36), primary_key=True))
+    Table('user', metadata, Column('id', String(120), primary_key=True))
+
+    return Table(
+        'balance_ledger', metadata,
+        Column('group_id', String(36), ForeignKey('group.id'), primary_key=True),
+        Column('user_id', String(120), ForeignKey('user.id'), primary_key=True, index=True),
+        Column('currency', String(3), primary_key=True),
+        Column('net_minor', BigInteger, nullable=False),
+        Column('updated_at', DateTime),
+    )
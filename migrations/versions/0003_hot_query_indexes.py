@@ -0,0 +1,28 @@
+"""
+Composite indexes for the queries behind the group, expense and notification pages.
+db.create_all() only creates indexes together with new tables, so existing
+databases get them here. Fresh databases already have them and are left alone.
+"""
+
+from sqlalchemy import text
+
+INDEXES = [
+    # Open expenses of a group, newest first, paginated on (date, id)
+    ('ix_expense_group_settled_date', 'expense', 'group_id, settled, "date" DESC, id DESC'),
+    # All expenses of a group, newest first
+    ('ix_expense_group_date', 'expense', 'group_id, "date" DESC, id DESC'),
+    # Recently settled expenses on the settlements page
+    ('ix_expense_group_settled_at', 'expense', 'group_id, settled, settled_at DESC'),
+    # Unread badge and newest-first notification lists
+    ('ix_notification_user_read_created', 'notification', 'user_id, "read", created_at DESC'),
+    # The primary keys of the association tables lead with user_id
+    ('ix_group_members_group_id', 'group_members', 'group_id'),
+    ('ix_expense_participants_expense_id', 'expense_participants', 'expense_id'),
+]
+
+def upgrade(connection):
+    for name, table, columns in INDEXES:
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+    # Refresh planner statistics so the new indexes are picked up
+    connection.execute(text("ANALYZE"))
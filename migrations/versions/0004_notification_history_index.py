@@ -0,0 +1,13 @@
+"""
+Index for the paginated notification history (newest first on (created_at, id)).
+Fresh databases already have it from the model and are left alone.
+"""
+
+from sqlalchemy import text
+
+def upgrade(connection):
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_notification_user_created "
+        "ON notification (user_id, created_at DESC, id DESC)"
+    ))
+    connection.execute(text("ANALYZE notification"))
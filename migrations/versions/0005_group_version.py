@@ -0,0 +1,12 @@
+"""
+Add group.version, the counter behind the ETags of the group pages and the
+balance-data API.
+"""
+
+from sqlalchemy import text
+
+from migrator import has_column
+
+def upgrade(connection):
+    if not has_column(connection, 'group', 'version'):
+        connection.execute(text('ALTER TABLE "group" ADD COLUMN version INTEGER NOT NULL DEFAULT 0'))
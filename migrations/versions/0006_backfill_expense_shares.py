@@ -0,0 +1,106 @@
+"""
+Store expense_share rows for expenses written before the table existed, so the
+balance aggregates and bulk settles see every expense. Expenses without
+participants never get share rows. Does nothing once every other expense has
+its shares.
+
+The split rules are copied here as they were when this migration was written
+(equal split, or custom percentages with leftover units going to the largest
+remainders), so later changes to Expense.split_amount don't change what it stores.
+"""
+
+import json
+from decimal import Decimal, ROUND_FLOOR, ROUND_HALF_UP
+
+from sqlalchemy import BigInteger, Column, ForeignKey, MetaData, String, Table, bindparam, text
+
+BATCH_SIZE = 500
+
+def upgrade(connection):
+    expense_share = expense_share_table()
+    expense_share.create(connection, checkfirst=True)
+
+    insert_share = text(
+        "INSERT INTO expense_share (expense_id, user_id, share_amount) "
+        "VALUES (:expense_id, :user_id, :share_amount)"
+    )
+    participants_query = text(
+        "SELECT expense_id, user_id FROM expense_participants WHERE expense_id IN :expense_ids"
+    ).bindparams(bindparam('expense_ids', expanding=True))
+
+    last_id = ''
+    while True:
+        # Keyset over expense.id, so each batch costs the same
+        expenses = connection.execute(text(
+            "SELECT id, amount_minor, custom_splits FROM expense "
+            "WHERE id > :last_id AND amount_minor IS NOT NULL "
+            "AND NOT EXISTS (SELECT 1 FROM expense_share WHERE expense_share.expense_id = expense.id) "
+            "AND EXISTS (SELECT 1 FROM expense_participants WHERE expense_participants.expense_id = expense.id) "
+            "ORDER BY id LIMIT :limit"
+        ), {'last_id': last_id, 'limit': BATCH_SIZE}).all()
+        if not expenses:
+            return
+
+        participants = {}
+        for expense_id, user_id in connection.execute(participants_query, {'expense_ids': [row.id for row in expenses]}):
+            participants.setdefault(expense_id, []).append(user_id)
+
+        rows = []
+        for expense_id, amount_minor, custom_splits in expenses:
+            splits = json.loads(custom_splits) if custom_splits else None
+            for user_id, share in _split_amount(amount_minor, participants.get(expense_id, []), splits).items():
+                rows.append({'expense_id': expense_id, 'user_id': user_id, 'share_amount': share})
+        if rows:
+            connection.execute(insert_share, rows)
+
+        last_id = expenses[-1].id
+
+def expense_share_table():
+    """The expense_share table as this migration expects it."""
+    metadata = MetaData()
+
+    # Referenced tables, only so the foreign keys resolve; they aren't created
+    Table('expense', metadata, Column('id', String(36), primary_key=True))
+    Table('user', metadata, Column('id', String(120), primary_key=True))
+
+    return Table(
+        'expense_share', metadata,
+        Column('expense_id', String(36), ForeignKey('expense.id'), primary_key=True),
+        Column('user_id', String(120), ForeignKey('user.id'), primary_key=True),
+        Column('share_amount', BigInteger, nullable=False),
+    )
+
+def _split_amount(total, participant_ids, custom_splits):
+    participant_ids = sorted(participant_ids)
+    if not participant_ids:
+        return {}
+
+    if custom_splits:
+        percentages = [custom_splits.get(user_id, 0) for user_id in participant_ids]
+        if sum(percentages) == 100:
+            owed = _allocate(total, percentages)
+        else:
+            owed = [_percentage_of(total, percentage) for percentage in percentages]
+    else:
+        owed = _allocate(total, [1] * len(participant_ids))
+
+    return dict(zip(participant_ids, owed))
+
+def _allocate(total, weights):
+    weights = [Decimal(str(weight)) for weight in weights]
+    weight_total = sum(weights)
+    if weight_total <= 0:
+        return [0] * len(weights)
+
+    exact = [total * weight / weight_total for weight in weights]
+    parts = [int(share.to_integral_value(rounding=ROUND_FLOOR)) for share in exact]
+
+    leftover = total - sum(parts)
+    by_remainder = sorted(range(len(weights)), key=lambda i: parts[i] - exact[i])
+    for i in by_remainder[:leftover]:
+        parts[i] += 1
+    return parts
+
+def _percentage_of(total, percentage):
+    share = Decimal(total) * Decimal(str(percentage)) / 100
+    return int(share.quantize(Decimal(1), rounding=ROUND_HALF_UP))
@@ -0,0 +1,102 @@
+"""
+Versioned schema migrations for SQLite and PostgreSQL.
+
+Each file in migrations/versions is one migration, named NNNN_description.py and
+defining upgrade(connection). Migrations run in version order, each in its own
+transaction, and the versions that have been applied are recorded in the
+schema_migrations table so every migration runs once per database.
+
+Run them with:
+    flask --app main migrate
+"""
+
+import importlib.util
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations', 'versions')
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+class Migration:
+    """A migration file from MIGRATIONS_DIR."""
+
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def load(self):
+        spec = importlib.util.spec_from_file_location(f"migration_{self.version}", self.path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+def discover_migrations():
+    """Get every migration in MIGRATIONS_DIR, ordered by version."""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append(Migration(match.group(1), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+def ensure_version_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(4) PRIMARY KEY, "
+            "name VARCHAR(200) NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL)"
+        ))
+
+def applied_versions(engine):
+    """Get a dictionary mapping applied versions to when they were applied."""
+    ensure_version_table(engine)
+    with engine.connect() as connection:
+        return dict(connection.execute(text("SELECT version, applied_at FROM schema_migrations")).all())
+
+def upgrade(engine, target=None, echo=print):
+    """
+    Apply every pending migration up to and including target (default: all).
+
+    Returns:
+        The list of migrations that were applied
+    """
+    done = applied_versions(engine)
+    applied = []
+
+    for migration in discover_migrations():
+        if target and migration.version > target:
+            break
+        if migration.version in done:
+            continue
+
+        echo(f"Applying {migration.version}_{migration.name}...")
+        module = migration.load()
+        with engine.begin() as connection:
+            module.upgrade(connection)
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {'version': migration.version, 'name': migration.name, 'applied_at': datetime.now()}
+            )
+        applied.append(migration)
+
+    return applied
+
+def status(engine):
+    """Get a list of (migration, applied_at) tuples; applied_at is None for pending migrations."""
+    done = applied_versions(engine)
+    return [(migration, done.get(migration.version)) for migration in discover_migrations()]
+
+# Helpers for migrations
+
+def has_table(connection, table):
+    return inspect(connection).has_table(table)
+
+def has_column(connection, table, column):
+    if not has_table(connection, table):
+        return False
+    return column in [info['name'] for info in inspect(connection).get_columns(table)]
@@ -5,7 +5,11 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from money import allocate, from_minor, percentage_of, to_minor
+from replica import RoutingSession
+
+# Reads of @read_replica routes go to DATABASE_REPLICA_URL when it is set
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Association tables for many-to-many relationships
 group_members = db.Table('group_members',
@@ -18,6 +22,10 @@ expense_participants = db.Table('expense_participants',
     db.Column('expense_id', db.String(36), db.ForeignKey('expense.id'), primary_key=True)
 )
 
+# The primary keys above lead with user_id; these serve lookups from the other side
+db.Index('ix_group_members_group_id', group_members.c.group_id)
+db.Index('ix_expense_participants_expense_id', expense_participants.c.expense_id)
+
 class User(UserMixin, db.Model):
     id = db.Column(db.String(120), primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -59,6 +67,7 @@ class Group(db.Model):
     created_by = db.Column(db.String(120), db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     invite_code = db.Column(db.String(8), unique=True, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)  # Increases whenever expenses, balances or members change
 
     # Relationships
     expenses = db.relationship('Expense', backref='group', lazy=True)
@@ -70,6 +79,7 @@ class Group(db.Model):
         self.created_by = created_by
         self.created_at = datetime.now()
         self.invite_code = str(uuid.uuid4())[:8]
+        self.version = 0
 
     def to_dict(self):
         return {
@@ -86,6 +96,7 @@ class Expense(db.Model):
     id = db.Column(db.String(36), primary_key=True)
     group_id = db.Column(db.String(36), db.ForeignKey('group.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
+    amount_minor = db.Column(db.BigInteger, nullable=True)  # Amount in the currency's minor unit
     description = db.Column(db.String(200), nullable=False)
     date = db.Column(db.DateTime, nullable=False)
     payer = db.Column(db.String(120), db.ForeignKey('user.id'), nullable=False)
@@ -100,11 +111,13 @@ class Expense(db.Model):
     participants = db.relationship('User', secondary=expense_participants,
                                   backref=db.backref('expenses_participated', lazy='dynamic'))
     settler = db.relationship('User', foreign_keys=[settled_by], backref='settled_expenses')
+    shares = db.relationship('ExpenseShare', backref='expense', lazy=True, cascade='all, delete-orphan')
 
     def __init__(self, group_id, amount, description, date, payer, participants=None, currency='USD', custom_splits=None):
         self.id = str(uuid.uuid4())
         self.group_id = group_id
         self.amount = float(amount)
+        self.amount_minor = to_minor(amount, currency)
         self.description = description
         self.date = date
         self.payer = payer
@@ -123,31 +136,99 @@ class Expense(db.Model):
             return json.loads(self.custom_splits)
         return None
 
-    def get_split_for_user(self, user_id):
-        """Calculate how much this user owes or is owed for this expense"""
-        participants_ids = [user.id for user in self.participants]
+    def get_amount_minor(self):
+        """Get the amount in integer minor units (e.g. cents)"""
+        if self.amount_minor is not None:
+            return self.amount_minor
+        return to_minor(self.amount, self.currency)
 
-        if user_id not in participants_ids:
-            return {'amount': 0, 'currency': self.currency}
+    def get_owed_shares(self):
+        """
+        Calculate how much of this expense each participant owes, in minor units.
+        Returns a dictionary mapping user_id to the owed amount.
+        """
+        return Expense.split_amount(
+            self.get_amount_minor(),
+            [user.id for user in self.participants],
+            self.get_custom_splits()
+        )
 
-        custom_splits = self.get_custom_splits()
+    def get_minor_shares(self):
+        """
+        Calculate the net amount in minor units for every participant of this expense in one pass.
+        Returns a dictionary mapping user_id to amount (positive if owed, negative if owing).
+        """
+        return Expense.net_shares(self.get_amount_minor(), self.payer, self.get_owed_shares())
+
+    @staticmethod
+    def split_amount(total, participant_ids, custom_splits=None):
+        """
+        Split an amount in minor units between participants. Shares always add up
+        to the exact amount; leftover units from uneven splits go to participants
+        in user ID order.
+
+        Args:
+            total: Amount in minor units
+            participant_ids: IDs of the participants
+            custom_splits: Optional dictionary mapping user_id to a percentage
+
+        Returns:
+            A dictionary mapping user_id to the owed amount
+        """
+        participants_ids = sorted(participant_ids)
+        if not participants_ids:
+            return {}
 
         if custom_splits:
             # Custom split based on percentages
-            if user_id in custom_splits:
-                share = self.amount * (custom_splits[user_id] / 100.0)
+            percentages = [custom_splits.get(user_id, 0) for user_id in participants_ids]
+            if sum(percentages) == 100:
+                owed = allocate(total, percentages)
             else:
-                share = 0
+                owed = [percentage_of(total, percentage) for percentage in percentages]
         else:
             # Equal split
-            share = self.amount / len(participants_ids)
+            owed = allocate(total, [1] * len(participants_ids))
 
-        # If user is the payer, they paid the full amount but owe their share
-        if user_id == self.payer:
-            amount = self.amount - share  # Positive: user is owed money
-        else:
-            amount = -share  # Negative: user owes money
+        return dict(zip(participants_ids, owed))
 
+    @staticmethod
+    def net_shares(total, payer, owed_shares):
+        """
+        Turn owed shares into net amounts: the payer is owed the total minus their
+        own share, everyone else owes their share.
+        """
+        shares = {}
+        for user_id, share in owed_shares.items():
+            # If user is the payer, they paid the full amount but owe their share
+            if user_id == payer:
+                shares[user_id] = total - share  # Positive: user is owed money
+            else:
+                shares[user_id] = -share  # Negative: user owes money
+
+        return shares
+
+    def record_shares(self):
+        """Store each participant's owed share in expense_share; call after participants are set"""
+        self.amount_minor = self.get_amount_minor()
+        self.shares = [
+            ExpenseShare(self.id, user_id, share)
+            for user_id, share in self.get_owed_shares().items()
+        ]
+
+    def get_shares(self):
+        """
+        Calculate the net amount for every participant of this expense in one pass.
+        Returns a dictionary mapping user_id to amount (positive if owed, negative if owing).
+        """
+        return {
+            user_id: from_minor(amount, self.currency)
+            for user_id, amount in self.get_minor_shares().items()
+        }
+
+    def get_split_for_user(self, user_id):
+        """Calculate how much this user owes or is owed for this expense"""
+        amount = self.get_shares().get(user_id, 0)
         return {'amount': amount, 'currency': self.currency}
 
     def to_dict(self):
@@ -167,6 +248,30 @@ class Expense(db.Model):
             'settled_by': self.settled_by
         }
 
+# Group expense lists: open expenses (or all of them) newest first, paginated on (date, id)
+db.Index('ix_expense_group_settled_date', Expense.group_id, Expense.settled, Expense.date.desc(), Expense.id.desc())
+db.Index('ix_expense_group_date', Expense.group_id, Expense.date.desc(), Expense.id.desc())
+# Recently settled expenses on the settlements page
+db.Index('ix_expense_group_settled_at', Expense.group_id, Expense.settled, Expense.settled_at.desc())
+
+class ExpenseShare(db.Model):
+    """Each participant's owed share of an expense, computed once when the expense is written."""
+    expense_id = db.Column(db.String(36), db.ForeignKey('expense.id'), primary_key=True)
+    user_id = db.Column(db.String(120), db.ForeignKey('user.id'), primary_key=True)
+    share_amount = db.Column(db.BigInteger, nullable=False)  # In the expense currency's minor unit
+
+    def __init__(self, expense_id, user_id, share_amount):
+        self.expense_id = expense_id
+        self.user_id = user_id
+        self.share_amount = share_amount
+
+    def to_dict(self):
+        return {
+            'expense_id': self.expense_id,
+            'user_id': self.user_id,
+            'share_amount': self.share_amount
+        }
+
 class Notification(db.Model):
     id = db.Column(db.String(36), primary_key=True)
     user_id = db.Column(db.String(120), db.ForeignKey('user.id'), nullable=False)
@@ -195,3 +300,108 @@ class Notification(db.Model):
             'read': self.read,
             'created_at': self.created_at
         }
+
+# Unread badge and newest-first notification lists
+db.Index('ix_notification_user_read_created', Notification.user_id, Notification.read, Notification.created_at.desc())
+
+# A user's full notification history, newest first, paginated on (created_at, id)
+db.Index('ix_notification_user_created', Notification.user_id, Notification.created_at.desc(), Notification.id.desc())
+
+class BalanceLedger(db.Model):
+    """Running net balance per group member and currency over unsettled expenses."""
+    group_id = db.Column(db.String(36), db.ForeignKey('group.id'), primary_key=True)
+    user_id = db.Column(db.String(120), db.ForeignKey('user.id'), primary_key=True, index=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    net_minor = db.Column(db.BigInteger, nullable=False, default=0)  # In the currency's minor unit
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __init__(self, group_id, user_id, currency, net_minor=0):
+        self.group_id = group_id
+        self.user_id = user_id
+        self.currency = currency
+        self.net_minor = net_minor
+        self.updated_at = datetime.now()
+
+    def to_dict(self):
+        return {
+            'group_id': self.group_id,
+            'user_id': self.user_id,
+            'currency': self.currency,
+            'net_amount': from_minor(self.net_minor, self.currency),
+            'updated_at': self.updated_at
+        }
+
+class SettlementEdge(db.Model):
+    """
+    A suggested transfer from the current settlement plan of a group, kept up to
+    date with the balance ledger so cross-group positions can be read per user.
+    """
+    group_id = db.Column(db.String(36), db.ForeignKey('group.id'), primary_key=True)
+    from_user = db.Column(db.String(120), db.ForeignKey('user.id'), primary_key=True, index=True)
+    to_user = db.Column(db.String(120), db.ForeignKey('user.id'), primary_key=True, index=True)
+    currency = db.Column(db.String(3), primary_key=True)
+    amount_minor = db.Column(db.BigInteger, nullable=False)  # In the currency's minor unit
+
+    def __init__(self, group_id, from_user, to_user, currency, amount_minor):
+        self.group_id = group_id
+        self.from_user = from_user
+        self.to_user = to_user
+        self.currency = currency
+        self.amount_minor = amount_minor
+
+    def to_dict(self):
+        return {
+            'group_id': self.group_id,
+            'from': self.from_user,
+            'to': self.to_user,
+            'currency': self.currency,
+            'amount': from_minor(self.amount_minor, self.currency)
+        }
+
+class EmailOutbox(db.Model):
+    """
+    An email waiting to be delivered by the outbox worker. Rows are written in the
+    same transaction as the change that triggered them, and (recipient, event_key)
+    is unique so the same event never emails the same person twice.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('recipient', 'event_key', name='uq_email_outbox_recipient_event'),
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    event_key = db.Column(db.String(120), nullable=False)  # e.g. "expense-added:<expense id>"
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, recipient, subject, html, event_key):
+        self.id = str(uuid.uuid4())
+        self.recipient = recipient
+        self.subject = subject
+        self.html = html
+        self.event_key = event_key
+        self.status = 'pending'
+        self.attempts = 0
+        self.next_attempt_at = datetime.now()
+        self.created_at = datetime.now()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'recipient': self.recipient,
+            'subject': self.subject,
+            'event_key': self.event_key,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at,
+            'last_error': self.last_error,
+            'created_at': self.created_at,
+            'sent_at': self.sent_at
+        }
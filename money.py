@@ -0,0 +1,106 @@
+"""
+Integer minor-unit money helpers.
+
+Amounts are handled as integers in the currency's minor unit (cents for USD,
+whole yen for JPY) so that balances add up exactly and no epsilon is needed
+when deciding whether someone is settled.
+"""
+
+from array import array
+from decimal import Decimal, ROUND_FLOOR, ROUND_HALF_UP
+
+# Number of decimal places in each currency's minor unit (ISO 4217);
+# anything not listed uses two
+CURRENCY_EXPONENTS = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0,
+    'PYG': 0, 'RWF': 0, 'UGX': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+DEFAULT_EXPONENT = 2
+
+def minor_exponent(currency):
+    """Get the number of decimal places in a currency's minor unit."""
+    return CURRENCY_EXPONENTS.get(currency, DEFAULT_EXPONENT)
+
+def to_minor(amount, currency):
+    """Convert a decimal amount into integer minor units, rounding half away from zero."""
+    exponent = minor_exponent(currency)
+    scaled = Decimal(str(amount)).scaleb(exponent)
+    return int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_minor(minor, currency):
+    """Convert integer minor units back into a decimal amount."""
+    exponent = minor_exponent(currency)
+    if exponent == 0:
+        return float(minor)
+    return round(minor / 10 ** exponent, exponent)
+
+def allocate(total, weights):
+    """
+    Split an integer total in proportion to weights, so the parts add up exactly.
+    Leftover units go to the parts with the largest remainders (ties go to the
+    earlier weight).
+
+    Args:
+        total: Integer amount in minor units
+        weights: List of non-negative weights (e.g. percentages or all ones)
+
+    Returns:
+        A list of integers, one per weight
+    """
+    weights = [Decimal(str(weight)) for weight in weights]
+    weight_total = sum(weights)
+    if not weights or weight_total <= 0:
+        return [0] * len(weights)
+
+    exact = [total * weight / weight_total for weight in weights]
+    parts = [int(share.to_integral_value(rounding=ROUND_FLOOR)) for share in exact]
+
+    leftover = total - sum(parts)
+    by_remainder = sorted(range(len(weights)), key=lambda i: parts[i] - exact[i])
+    for i in by_remainder[:leftover]:
+        parts[i] += 1
+
+    return parts
+
+def percentage_of(total, percentage):
+    """Get a percentage of an integer total in minor units, rounding half away from zero."""
+    share = Decimal(total) * Decimal(str(percentage)) / 100
+    return int(share.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+class MinorLedger:
+    """
+    Compact per-currency balance accumulator.
+
+    Each currency gets one array('q') of signed 64-bit minor-unit balances,
+    indexed by the member's position, instead of a dict of floats per member.
+
+    Args:
+        member_ids: Ordered list of member IDs
+    """
+
+    def __init__(self, member_ids):
+        self.member_ids = list(member_ids)
+        self.positions = {member_id: position for position, member_id in enumerate(self.member_ids)}
+        self.columns = {}
+
+    def add(self, currency, member_id, minor):
+        """Add an amount in minor units to a member's balance; non-members are ignored."""
+        column = self.columns.get(currency)
+        if column is None:
+            column = self.columns[currency] = array('q', bytes(8 * len(self.member_ids)))
+
+        position = self.positions.get(member_id)
+        if position is not None:
+            column[position] += minor
+
+    def to_balances(self):
+        """
+        Get the balances as a dictionary mapping user_id to a dictionary of currencies
+        and decimal amounts, with every member listed for every currency used.
+        """
+        balances = {member_id: {} for member_id in self.member_ids}
+        for currency, column in self.columns.items():
+            for member_id, minor in zip(self.member_ids, column):
+                balances[member_id][currency] = from_minor(minor, currency)
+        return balances
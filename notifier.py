@@ -0,0 +1,189 @@
+"""
+Fan-out of "you have new notifications" signals to open notification streams.
+
+Routes call publish() after committing new Notification rows. Every worker
+process that has streams open runs one watcher thread that picks up signals and
+wakes the streams of the users concerned, so an idle stream costs no database
+queries at all.
+
+Signals travel between gunicorn workers through a small SQLite file shared by
+every worker on the host (the same approach as rate_cache). Without a path the
+hub only works inside one process, which is enough for the development server.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_hub = None
+
+class StreamLimitReached(Exception):
+    """Raised when a process already serves the maximum number of streams."""
+
+class Subscription:
+    """An open stream waiting for signals for one user."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._event = threading.Event()
+
+    def wait(self, timeout):
+        """
+        Wait until the user may have new notifications.
+
+        Returns:
+            True if a signal arrived, False on timeout
+        """
+        signalled = self._event.wait(timeout)
+        self._event.clear()
+        return signalled
+
+    def wake(self):
+        self._event.set()
+
+class NotificationHub:
+    """
+    Wakes notification streams when new notifications are published.
+
+    Args:
+        path: Path of the SQLite file shared between workers, or None for in-process only
+        poll_interval: Seconds between checks for signals from other workers
+        max_streams: Maximum number of open streams in this process
+    """
+
+    def __init__(self, path=None, poll_interval=1.0, max_streams=20):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_streams = max_streams
+
+        self._subscriptions = {}  # user_id -> set of Subscription
+        self._count = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._initialized = False
+
+    def publish(self, user_ids):
+        """Signal that the given users have new notifications."""
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+
+        if self.path:
+            try:
+                self._write(user_ids)
+            except sqlite3.Error as e:
+                logger.warning("Notification signal not shared with other workers: %s", e)
+
+        self._wake(user_ids)
+
+    def subscribe(self, user_id):
+        """
+        Open a subscription for a user's stream.
+
+        Raises:
+            StreamLimitReached: If this process already serves max_streams streams
+        """
+        subscription = Subscription(user_id)
+        with self._lock:
+            if self._count >= self.max_streams:
+                raise StreamLimitReached()
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            self._count += 1
+
+            if self.path and self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='notification-watcher', daemon=True)
+                self._watcher.start()
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions and subscription in subscriptions:
+                subscriptions.discard(subscription)
+                self._count -= 1
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def _wake(self, user_ids):
+        with self._lock:
+            subscriptions = [
+                subscription
+                for user_id in user_ids
+                for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription in subscriptions:
+            subscription.wake()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS notification_signal ('
+                'user_id TEXT PRIMARY KEY, seq INTEGER NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_notification_signal_seq ON notification_signal (seq)')
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _write(self, user_ids):
+        """Give each user's signal a new sequence number, in one write transaction."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM notification_signal').fetchone()[0]
+                conn.executemany(
+                    'INSERT OR REPLACE INTO notification_signal (user_id, seq) VALUES (?, ?)',
+                    [(user_id, seq + 1) for user_id in user_ids]
+                )
+        finally:
+            conn.close()
+
+    def _watch(self):
+        """Wake local streams for signals written by any worker, polling the shared file."""
+        conn = None
+        last_seq = None
+        while True:
+            try:
+                if conn is None:
+                    conn = self._connect()
+
+                if last_seq is None:
+                    # Only signals published after the watcher started are of interest
+                    last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM notification_signal').fetchone()[0]
+
+                rows = conn.execute(
+                    'SELECT user_id, seq FROM notification_signal WHERE seq > ?', (last_seq,)
+                ).fetchall()
+                if rows:
+                    last_seq = max(seq for _, seq in rows)
+                    self._wake(user_id for user_id, _ in rows)
+            except sqlite3.Error as e:
+                logger.warning("Notification watcher error: %s", e)
+                if conn is not None:
+                    conn.close()
+                conn = None
+
+            time.sleep(self.poll_interval)
+
+def get_hub():
+    """Get this process's notification hub, configured from Config."""
+    global _hub
+    if _hub is None:
+        from config import Config
+        _hub = NotificationHub(
+            Config.NOTIFICATION_SIGNAL_PATH or None,
+            poll_interval=Config.NOTIFICATION_SIGNAL_POLL_INTERVAL,
+            max_streams=Config.NOTIFICATION_STREAM_MAX_CLIENTS
+        )
+    return _hub
+
+def publish(user_ids):
+    """Signal open streams that the given users have new notifications. Call after committing them."""
+    get_hub().publish(user_ids)
@@ -0,0 +1,209 @@
+"""
+Transactional email outbox.
+
+Request handlers queue emails as EmailOutbox rows in the same transaction as the
+change that triggers them, so a request never waits on the email provider. A
+separate worker process (`flask --app main drain-outbox`) claims pending rows,
+sends them through the Resend batch API from a bounded thread pool that reuses
+HTTP connections, and retries failures with exponential backoff.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from metrics import span
+from models import db, EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+SENDER = "ExpenseSplitter <notifications@expensesplitter.app>"
+RESEND_BATCH_URL = "https://api.resend.com/emails/batch"
+RESEND_BATCH_LIMIT = 100  # Most emails Resend accepts in one batch request
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 30  # seconds; doubles with every failed attempt
+BACKOFF_MAX = 3600  # seconds
+CLAIM_TIMEOUT = 300  # seconds before a row stuck in 'sending' is picked up again
+
+_local = threading.local()
+_executor = None
+
+def queue_emails(messages):
+    """
+    Add emails to the outbox without committing. Messages for a recipient and
+    event that are already queued (or repeated in the list) are skipped.
+
+    Args:
+        messages: List of dictionaries with to_email, subject, html_content and event_key
+
+    Returns:
+        The list of EmailOutbox rows added to the session
+    """
+    messages = [message for message in messages if message.get('to_email')]
+    if not messages:
+        return []
+
+    recipients = {message['to_email'] for message in messages}
+    event_keys = {message['event_key'] for message in messages}
+    seen = set(db.session.query(EmailOutbox.recipient, EmailOutbox.event_key).filter(
+        EmailOutbox.recipient.in_(recipients),
+        EmailOutbox.event_key.in_(event_keys)
+    ).all())
+
+    rows = []
+    for message in messages:
+        key = (message['to_email'], message['event_key'])
+        if key in seen:
+            continue
+        seen.add(key)
+
+        row = EmailOutbox(message['to_email'], message['subject'], message['html_content'], message['event_key'])
+        db.session.add(row)
+        rows.append(row)
+
+    return rows
+
+def queue_email(to_email, subject, html_content, event_key):
+    """Add a single email to the outbox without committing."""
+    rows = queue_emails([{
+        'to_email': to_email,
+        'subject': subject,
+        'html_content': html_content,
+        'event_key': event_key
+    }])
+    return rows[0] if rows else None
+
+def claim_pending(limit):
+    """
+    Claim up to limit emails that are due, marking them as 'sending' so other
+    workers skip them. Rows left in 'sending' by a crashed worker are reclaimed
+    after CLAIM_TIMEOUT.
+    """
+    now = datetime.now()
+    rows = EmailOutbox.query.filter(
+        db.or_(
+            db.and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+            db.and_(EmailOutbox.status == 'sending', EmailOutbox.next_attempt_at <= now - timedelta(seconds=CLAIM_TIMEOUT))
+        )
+    ).order_by(
+        EmailOutbox.next_attempt_at
+    ).limit(limit).with_for_update(skip_locked=True).all()
+
+    for row in rows:
+        row.status = 'sending'
+        row.next_attempt_at = now
+    ids = [row.id for row in rows]
+    db.session.commit()
+
+    # Reload the claimed rows in one query instead of one per expired row
+    return EmailOutbox.query.filter(EmailOutbox.id.in_(ids)).all() if ids else []
+
+def _get_executor(max_workers):
+    """Get the worker's thread pool; it lives as long as the process so HTTP sessions stay warm."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='outbox')
+    return _executor
+
+def _session():
+    """Get this thread's HTTP session, so connections to the provider are reused."""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        # Imported here so web workers, which only queue emails, don't load the HTTP client
+        import requests
+        session = _local.session = requests.Session()
+    return session
+
+@span('send_email.batch')
+def _send_batch(api_key, payload):
+    """
+    Send one batch of emails. Runs on a pool thread and only does HTTP.
+
+    Returns:
+        None on success, or an error message
+    """
+    import requests
+
+    try:
+        response = _session().post(
+            RESEND_BATCH_URL,
+            json=payload,
+            headers={'Authorization': f"Bearer {api_key}"},
+            timeout=10
+        )
+        if response.status_code == 200:
+            return None
+        return f"{response.status_code} - {response.text}"
+    except requests.RequestException as e:
+        return str(e)
+
+def deliver(rows, api_key, max_workers=4):
+    """
+    Send claimed rows in batches on a bounded thread pool and record the results.
+
+    Returns:
+        A tuple (sent, retried, failed)
+    """
+    batches = [rows[i:i + RESEND_BATCH_LIMIT] for i in range(0, len(rows), RESEND_BATCH_LIMIT)]
+    payloads = [
+        [{'from': SENDER, 'to': [row.recipient], 'subject': row.subject, 'html': row.html} for row in batch]
+        for batch in batches
+    ]
+
+    pool = _get_executor(max_workers)
+    errors = list(pool.map(lambda payload: _send_batch(api_key, payload), payloads))
+
+    sent = retried = failed = 0
+    now = datetime.now()
+    for batch, error in zip(batches, errors):
+        for row in batch:
+            row.attempts += 1
+            if error is None:
+                row.status = 'sent'
+                row.sent_at = now
+                row.last_error = None
+                sent += 1
+            elif row.attempts >= MAX_ATTEMPTS:
+                row.status = 'failed'
+                row.last_error = error
+                failed += 1
+            else:
+                row.status = 'pending'
+                row.last_error = error
+                row.next_attempt_at = now + timedelta(seconds=min(BACKOFF_BASE * 2 ** (row.attempts - 1), BACKOFF_MAX))
+                retried += 1
+        if error is not None:
+            logger.warning("Error sending %d emails: %s", len(batch), error)
+
+    db.session.commit()
+    return sent, retried, failed
+
+def drain_outbox(api_key, batch_size=500, max_workers=4):
+    """
+    Send everything that is currently due.
+
+    Returns:
+        A tuple (sent, retried, failed) with the totals
+    """
+    totals = [0, 0, 0]
+    while True:
+        rows = claim_pending(batch_size)
+        if not rows:
+            return tuple(totals)
+
+        for i, count in enumerate(deliver(rows, api_key, max_workers)):
+            totals[i] += count
+
+def run_worker(api_key, poll_interval=5, batch_size=500, max_workers=4, once=False):
+    """Drain the outbox, then keep polling for new emails unless once is set."""
+    while True:
+        sent, retried, failed = drain_outbox(api_key, batch_size, max_workers)
+        if sent or retried or failed:
+            logger.info("Outbox: %d sent, %d to retry, %d failed", sent, retried, failed)
+
+        if once:
+            return
+        time.sleep(poll_interval)
@@ -0,0 +1,135 @@
+"""
+Query plan report for the main routes.
+
+Runs the data access behind each route against a real group and user, records
+the SQL it issues, and prints the database's plan for every statement
+(EXPLAIN QUERY PLAN on SQLite, EXPLAIN on PostgreSQL). Statements that scan a
+whole table or sort without an index are flagged.
+
+Run it with:
+    flask --app main explain-queries [--group-id ID] [--user-id ID]
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event, func
+
+from models import db, Expense, Group, group_members
+from snapshot import load_group_snapshot, load_expense_page, encode_cursor
+from utils import aggregate_balances, get_ledger_balances, get_notification_badge, get_notification_page, get_user_position
+
+# Plan fragments that point at a missing index
+SQLITE_WARNINGS = ('USE TEMP B-TREE FOR ORDER BY',)
+POSTGRESQL_WARNINGS = ('Seq Scan',)
+
+@contextmanager
+def capture_statements():
+    """Record every SQL statement (and its parameters) executed inside the block."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+def route_queries(group_id, user_id):
+    """Get (route, callable) pairs that run the data access behind each route."""
+    def expenses_second_page():
+        first = Expense.query.filter_by(group_id=group_id, settled=False).order_by(
+            Expense.date.desc(), Expense.id.desc()
+        ).first()
+        cursor = encode_cursor(first) if first else None
+        load_expense_page(group_id, False, cursor)
+
+    def group_page():
+        snapshot = load_group_snapshot(group_id, expenses='open', limit=10)
+        get_ledger_balances(group_id, snapshot.members)
+
+    return [
+        ('view_group', group_page),
+        ('view_expenses', lambda: load_expense_page(group_id, False)),
+        ('view_expenses?cursor', expenses_second_page),
+        ('view_expenses?show_settled', lambda: load_expense_page(group_id, True)),
+        ('view_settlements', lambda: load_group_snapshot(group_id, expenses='settled', limit=5)),
+        ('view_settlements?include_settled', lambda: aggregate_balances(group_id, True)),
+        ('dashboard', lambda: get_user_position(user_id)),
+        ('notification badge', lambda: get_notification_badge(user_id)),
+        ('view_notifications', lambda: get_notification_page(user_id)),
+    ]
+
+def explain(statement, parameters):
+    """Get the plan for a statement as a list of lines."""
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        rows = connection.exec_driver_sql("EXPLAIN " + statement, parameters).all()
+        return [row[0] for row in rows]
+
+    rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+    return [row[-1] for row in rows]
+
+def plan_warnings(plan, dialect):
+    """Get the lines of a plan that suggest a missing index."""
+    if dialect == 'postgresql':
+        return [line for line in plan if any(warning in line for warning in POSTGRESQL_WARNINGS)]
+
+    warnings = []
+    for line in plan:
+        # "SCAN table" is a full table scan; "SCAN table USING INDEX" walks an index
+        if line.startswith('SCAN ') and 'USING' not in line:
+            warnings.append(line)
+        elif any(warning in line for warning in SQLITE_WARNINGS):
+            warnings.append(line)
+    return warnings
+
+def default_group_and_user():
+    """Pick the group with the most expenses and one of its members."""
+    group_id = db.session.query(Expense.group_id).group_by(
+        Expense.group_id
+    ).order_by(
+        func.count().desc()
+    ).limit(1).scalar()
+    if group_id is None:
+        group_id = db.session.query(Group.id).limit(1).scalar()
+    if group_id is None:
+        return None, None
+
+    user_id = db.session.query(group_members.c.user_id).filter(
+        group_members.c.group_id == group_id
+    ).limit(1).scalar()
+    return group_id, user_id
+
+def report(group_id, user_id, echo=print):
+    """
+    Print the plan of every statement behind the main routes.
+
+    Returns:
+        The number of statements with warnings
+    """
+    dialect = db.engine.dialect.name
+    flagged = 0
+
+    for route, run in route_queries(group_id, user_id):
+        with capture_statements() as statements:
+            run()
+        db.session.rollback()
+
+        echo(f"== {route} ({len(statements)} queries)")
+        for statement, parameters in statements:
+            plan = explain(statement, parameters)
+            warnings = plan_warnings(plan, dialect)
+            flagged += bool(warnings)
+
+            echo(("!! " if warnings else "   ") + " ".join(statement.split())[:160])
+            for line in plan:
+                echo(f"      {line}")
+        echo("")
+
+    if dialect == 'postgresql':
+        echo("Note: PostgreSQL prefers sequential scans on small tables; check plans on production-sized data.")
+    return flagged
@@ -0,0 +1,154 @@
+"""
+Exchange rate cache shared by every worker process on the host.
+
+Rates are kept in a small SQLite file so that all gunicorn workers see the same
+copy. When the cached rates are older than the TTL, exactly one worker claims the
+refresh and fetches new rates in a background thread; everyone else keeps serving
+the stale rates until the new ones land. A worker that loses the claim, or
+whose fetch failed, doesn't look at the file again for a short backoff.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'latest'
+
+class RateCache:
+    """
+    TTL cache with single-flight refresh, backed by a SQLite file.
+
+    Args:
+        path: Path of the SQLite file shared between workers
+        ttl: Number of seconds rates stay fresh
+        fetch: Callable returning a rates dictionary, or None if the fetch failed
+        refresh_timeout: Seconds after which an unfinished refresh claim expires,
+            which also acts as the retry delay after a failed fetch
+        claim_backoff: Seconds this process waits after losing a refresh claim
+            before it reads the file and tries to claim again
+    """
+
+    def __init__(self, path, ttl, fetch, refresh_timeout=30, claim_backoff=5):
+        self.path = path
+        self.ttl = ttl
+        self.fetch = fetch
+        self.refresh_timeout = refresh_timeout
+        self.claim_backoff = claim_backoff
+
+        # Per-process copy so fresh rates don't need a file read on every call
+        self._rates = None
+        self._fetched_at = 0
+        self._retry_at = 0  # No file reads or claims before this time
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def get(self):
+        """
+        Get the cached rates, triggering a refresh if they are stale.
+
+        Returns:
+            dict: The cached rates, or None if nothing has been fetched yet
+        """
+        now = time.time()
+        if self._rates is not None and now - self._fetched_at < self.ttl:
+            return self._rates
+
+        # Another worker is refreshing, or a fetch just failed: keep serving what this
+        # process has instead of taking the file's write lock on every call
+        if now < self._retry_at:
+            return self._rates
+
+        try:
+            rates, fetched_at = self._read()
+        except sqlite3.Error as e:
+            logger.warning("Exchange rate cache unavailable, fetching directly: %s", e)
+            return self.fetch()
+
+        if rates is not None:
+            self._rates, self._fetched_at = rates, fetched_at
+            if now - fetched_at >= self.ttl:
+                if self._claim_refresh(now):
+                    # Serve the stale rates while one worker refreshes in the background
+                    threading.Thread(target=self._refresh, name='rate-cache-refresh', daemon=True).start()
+                else:
+                    self._retry_at = now + self.claim_backoff
+            return rates
+
+        # Nothing cached yet: the worker holding the claim fetches inline
+        if self._claim_refresh(now):
+            return self._refresh()
+        self._retry_at = now + self.claim_backoff
+        return None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            with self._lock:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS rate_cache ('
+                    'key TEXT PRIMARY KEY, rates TEXT, fetched_at REAL NOT NULL DEFAULT 0, '
+                    'refresh_started REAL NOT NULL DEFAULT 0)'
+                )
+                conn.execute('INSERT OR IGNORE INTO rate_cache (key) VALUES (?)', (CACHE_KEY,))
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def _read(self):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT rates, fetched_at FROM rate_cache WHERE key = ?', (CACHE_KEY,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if row is None or row[0] is None:
+            return None, 0
+        return json.loads(row[0]), row[1]
+
+    def _claim_refresh(self, now):
+        """Atomically claim the refresh so only one worker fetches at a time."""
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.execute(
+                    'UPDATE rate_cache SET refresh_started = ? WHERE key = ? AND refresh_started < ?',
+                    (now, CACHE_KEY, now - self.refresh_timeout)
+                )
+                conn.commit()
+                return cursor.rowcount == 1
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("Could not claim exchange rate refresh: %s", e)
+            return False
+
+    def _refresh(self):
+        rates = self.fetch()
+        if rates is None:
+            # Keep the claim so the next attempt waits for refresh_timeout
+            self._retry_at = time.time() + self.refresh_timeout
+            return None
+
+        fetched_at = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    'UPDATE rate_cache SET rates = ?, fetched_at = ?, refresh_started = 0 WHERE key = ?',
+                    (json.dumps(rates), fetched_at, CACHE_KEY)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("Could not store exchange rates: %s", e)
+
+        self._rates, self._fetched_at = rates, fetched_at
+        return rates
@@ -0,0 +1,67 @@
+"""
+Read replica routing for db.session.
+
+Routes decorated with @read_replica send their reads to the engine configured
+with DATABASE_REPLICA_URL (the 'replica' bind). Everything else goes to the
+primary, which covers:
+
+- every write: flushes and INSERT/UPDATE/DELETE statements
+- every read in a session after it has written, so a request always sees its
+  own changes
+- every request for DATABASE_REPLICA_STICKY_SECONDS after the same browser
+  session wrote something, so a redirect after a POST doesn't show a lagging
+  replica
+
+Without a replica URL, everything uses the primary and the decorator does nothing.
+"""
+
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND = 'replica'
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that reads from the replica when the request allows it."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica(clause):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self, clause):
+        if self.info.get('wrote'):
+            return False
+
+        if self._flushing or isinstance(clause, UpdateBase):
+            # Stay on the primary from now on so later reads see this write
+            self.info['wrote'] = True
+            if has_request_context():
+                g._db_wrote = True
+            return False
+
+        return has_request_context() and g.get('_db_read_replica', False)
+
+def read_replica(view):
+    """Let a read-only view read from the replica, unless this browser wrote something just now."""
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        if session.get('_db_primary_until', 0) < time.time():
+            g._db_read_replica = True
+        return view(*args, **kwargs)
+
+    return decorated_view
+
+def init_app(app):
+    """Keep a browser on the primary for a few seconds after its request wrote to the database."""
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('_db_wrote') and current_app.config.get('SQLALCHEMY_BINDS', {}).get(REPLICA_BIND):
+            session['_db_primary_until'] = time.time() + current_app.config['DATABASE_REPLICA_STICKY_SECONDS']
+        return response
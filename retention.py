@@ -0,0 +1,93 @@
+"""
+Retention for the notification table.
+
+Read notifications older than the retention period are deleted, and each user's
+read history is capped at their newest N. Unread notifications are never
+touched. Deleted rows can be appended to a gzipped JSON Lines archive first.
+
+Work is done user by user in small batches, each in its own transaction, along
+the (user_id, read, created_at) index, so the job can run next to the app.
+
+Run it with:
+    flask --app main prune-notifications [--archive notifications.jsonl.gz] [--vacuum]
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from models import db, User, Notification
+
+PRUNE_BATCH_SIZE = 1000
+
+def _archive_rows(archive, notifications):
+    for notification in notifications:
+        row = notification.to_dict()
+        row['created_at'] = notification.created_at.isoformat() if notification.created_at else None
+        archive.write(json.dumps(row) + '\n')
+
+def _delete_batches(query, batch_size, archive=None):
+    """Delete the rows matching a query one batch at a time. Returns the number deleted."""
+    deleted = 0
+    while True:
+        notifications = query.limit(batch_size).all()
+        if not notifications:
+            return deleted
+
+        if archive is not None:
+            _archive_rows(archive, notifications)
+
+        Notification.query.filter(
+            Notification.id.in_([notification.id for notification in notifications])
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(notifications)
+
+def prune_notifications(max_age_days=None, max_per_user=None, archive=None, batch_size=PRUNE_BATCH_SIZE):
+    """
+    Delete old read notifications.
+
+    Args:
+        max_age_days: Delete read notifications older than this many days (None to keep them)
+        max_per_user: Keep at most this many read notifications per user (None for no cap)
+        archive: Optional text file to write deleted rows to as JSON Lines
+        batch_size: Number of rows to delete per transaction
+
+    Returns:
+        The number of notifications deleted
+    """
+    cutoff = datetime.now() - timedelta(days=max_age_days) if max_age_days is not None else None
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).all()]
+
+    deleted = 0
+    for user_id in user_ids:
+        read = Notification.query.filter(
+            Notification.user_id == user_id,
+            Notification.read == True
+        )
+
+        # Past the retention period
+        if cutoff is not None:
+            deleted += _delete_batches(read.filter(Notification.created_at < cutoff), batch_size, archive)
+
+        # Beyond the newest max_per_user
+        if max_per_user is not None:
+            overflow = read.order_by(Notification.created_at.desc(), Notification.id.desc()).offset(max_per_user)
+            deleted += _delete_batches(overflow, batch_size, archive)
+
+        # Nothing from this user is needed again
+        db.session.expunge_all()
+
+    return deleted
+
+def compact_database(engine):
+    """
+    Give the space freed by deletions back to the file system (SQLite) or mark it
+    for reuse and refresh statistics (PostgreSQL). Runs outside a transaction.
+    """
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if engine.dialect.name == 'postgresql':
+            connection.execute(text("VACUUM (ANALYZE) notification"))
+        else:
+            connection.execute(text("VACUUM"))
@@ -1,17 +1,34 @@
 import os
-import csv
+import hmac
 import io
 import json
+import time
+import unicodedata
 import uuid
 from datetime import datetime
-from flask import render_template, redirect, url_for, request, flash, session, jsonify, send_file
+from urllib.parse import quote
+from flask import render_template, redirect, url_for, request, flash, session, jsonify, make_response, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
 from sqlalchemy.exc import IntegrityError
 
 from app import app, db
+import notifier
+from etags import group_etag, not_modified, with_etag
+from export import generate_group_csv
+from importer import ImportFormatError, detect_format, read_records, import_expenses
+from metrics import render_metrics
 from models import User, Group, Expense, Notification
-from utils import calculate_balances, get_settlement_plan, get_exchange_rates
+from outbox import queue_emails
+from replica import read_replica
+from snapshot import load_group_snapshot, load_expense_page, load_expenses
+from user_cache import invalidate_user
+from utils import calculate_balances, get_settlement_plan, get_exchange_rates, apply_expense_to_ledger, get_ledger_balances, get_user_position, get_notification_badge, take_unread_notifications, mark_notifications_read, get_notification_page, settle_expenses, add_notifications, bump_group_version
+
+def get_page_size():
+    """Get the expense page size from the limit query parameter, capped by the config."""
+    page_size = request.args.get('limit', app.config['EXPENSE_PAGE_SIZE'], type=int)
+    return max(1, min(page_size, app.config['EXPENSE_PAGE_SIZE_MAX']))
 
 # Template context processors
 @app.context_processor
@@ -20,12 +37,13 @@ def utility_processor():
 
 @app.context_processor
 def inject_notifications():
-    """Add notifications to all templates."""
+    """Add the unread notification count and the newest unread notifications to all templates."""
     if current_user.is_authenticated:
-        user_notifications = Notification.query.filter_by(user_id=current_user.id).all()
-        unread_count = sum(1 for notif in user_notifications if not notif.read)
-        return {'notifications': user_notifications, 'unread_count': unread_count}
-    return {'notifications': [], 'unread_count': 0}
+        unread_count, recent_notifications = get_notification_badge(
+            current_user.id, app.config['NOTIFICATION_BADGE_LIMIT']
+        )
+        return {'recent_notifications': recent_notifications, 'unread_count': unread_count}
+    return {'recent_notifications': [], 'unread_count': 0}
 
 # Home route
 @app.route('/')
@@ -108,12 +126,14 @@ def dashboard():
 
     # Get user's notifications
     user_notifications = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.created_at.desc()).limit(5).all()
-    unread_count = Notification.query.filter_by(user_id=current_user.id, read=False).count()
+
+    # Get the user's net position across all groups
+    position = get_user_position(current_user.id, current_user.preferred_currency)
 
     return render_template('dashboard.html',
                           groups=user_groups,
                           notifications=user_notifications,
-                          unread_count=unread_count)
+                          position=position)
 
 # Group routes
 @app.route('/groups/create', methods=['GET', 'POST'])
@@ -126,10 +146,11 @@ def create_group():
         group = Group(name=group_name, created_by=current_user.id)
 
         # Add the current user to the group (relationship is handled in the model)
-        group.members_rel.append(current_user)
+        group.members_rel.append(current_user.record())
 
         db.session.add(group)
         db.session.commit()
+        invalidate_user(current_user.id)
 
         flash(f'Group "{group_name}" created successfully!', 'success')
         return redirect(url_for('view_group', group_id=group.id))
@@ -147,12 +168,14 @@ def join_group():
 
         if found_group:
             # Check if user is already a member
-            if current_user in found_group.members_rel:
+            if current_user.is_member(found_group.id):
                 flash('You are already a member of this group!', 'info')
             else:
                 # Add user to group
-                found_group.members_rel.append(current_user)
+                found_group.members_rel.append(current_user.record())
+                bump_group_version(found_group.id)
                 db.session.commit()
+                invalidate_user(current_user.id)
 
                 flash(f'Successfully joined the group "{found_group.name}"!', 'success')
                 return redirect(url_for('view_group', group_id=found_group.id))
@@ -162,65 +185,67 @@ def join_group():
     return render_template('join_group.html')
 
 @app.route('/groups/<group_id>')
+@read_replica
 @login_required
 def view_group(group_id):
-    group = Group.query.get(group_id)
+    # Get show_settled parameter from query string (default: False)
+    show_settled = request.args.get('show_settled', '').lower() in ('true', '1', 't', 'yes')
+
+    # Load the group and its members
+    snapshot = load_group_snapshot(group_id)
 
-    if not group or current_user not in group.members_rel:
+    if not snapshot or not snapshot.is_member(current_user.id):
         flash('Group not found or you are not a member!', 'danger')
         return redirect(url_for('dashboard'))
 
-    # Get group members
-    group_members = group.members_rel.all()
-
-    # Get group expenses
-    group_expenses = Expense.query.filter_by(group_id=group_id).order_by(Expense.date.desc()).all()
+    group = snapshot.group
+    group_members = snapshot.members
 
     # Get display currency from query parameter or user preference
     display_currency = request.args.get('currency') or current_user.preferred_currency
 
-    # Get show_settled parameter from query string (default: False)
-    show_settled = request.args.get('show_settled', '').lower() in ('true', '1', 't', 'yes')
+    # Nothing to do if the browser already has this version of the page
+    etag = group_etag(group, current_user, display_currency)
+    response = not_modified(etag)
+    if response:
+        return response
 
-    # Calculate balances (excluding settled expenses by default)
-    balances = calculate_balances(group_id, group_expenses, group_members, display_currency, include_settled=False)
+    # Load the 10 most recent expenses to show
+    load_expenses(snapshot, 'all' if show_settled else 'open', limit=10)
+
+    # Read balances from the ledger (settled expenses are already excluded)
+    balances = get_ledger_balances(group_id, group_members, display_currency)
 
     # Get settlement plan
     settlement_plan = get_settlement_plan(balances, display_currency)
 
-    # Filter expenses based on show_settled parameter
-    if not show_settled:
-        # Only show unsettled expenses
-        filtered_expenses = [exp for exp in group_expenses if not exp.settled]
-    else:
-        # Show all expenses
-        filtered_expenses = group_expenses
-
     # Get all available currencies for the dropdown
     available_currencies = list(get_exchange_rates().keys())
 
-    return render_template('group.html',
+    return with_etag(make_response(render_template('group.html',
                           group=group,
                           members=group_members,
-                          expenses=filtered_expenses[:10],  # Show only the 10 most recent
+                          expenses=snapshot.expenses,
                           balances=balances,
                           settlement_plan=settlement_plan,
                           display_currency=display_currency,
                           available_currencies=available_currencies,
-                          show_settled=show_settled)
+                          show_settled=show_settled)), etag)
 
 # Expense routes
 @app.route('/groups/<group_id>/add-expense', methods=['GET', 'POST'])
 @login_required
 def add_expense(group_id):
-    group = Group.query.get(group_id)
+    snapshot = load_group_snapshot(group_id)
 
-    if not group or current_user not in group.members_rel:
+    if not snapshot or not snapshot.is_member(current_user.id):
         flash('Group not found or you are not a member!', 'danger')
         return redirect(url_for('dashboard'))
 
+    group = snapshot.group
+
     # Get group members for the form
-    group_members = group.members_rel.all()
+    group_members = snapshot.members
 
     # Get exchange rates for currency conversion
     exchange_rates = get_exchange_rates()
@@ -272,32 +297,34 @@ def add_expense(group_id):
             custom_splits=custom_splits
         )
 
-        # Add participants to the expense
-        for participant_id in participants:
-            participant_user = User.query.get(participant_id)
-            if participant_user:
-                expense.participants.append(participant_user)
+        # Add participants to the expense, loading them in one query
+        participant_users = User.query.filter(User.id.in_(participants)).all() if participants else []
+        expense.participants.extend(participant_users)
+
+        # Store each participant's share so balances can be summed in the database
+        expense.record_shares()
 
         db.session.add(expense)
-        db.session.commit()
+
+        # Update the group's balance ledger in the same transaction
+        apply_expense_to_ledger(expense)
 
         # Create notifications for all participants except the one adding the expense
-        for participant_id in participants:
-            if participant_id != current_user.id:
+        group_link = url_for('view_group', group_id=group_id, _external=True)
+        emails = []
+        for participant_user in participant_users:
+            if participant_user.id != current_user.id:
                 # Create in-app notification
                 notification = Notification(
-                    user_id=participant_id,
+                    user_id=participant_user.id,
                     title=f"New Expense in {group.name}",
                     message=f"{current_user.username} added a new expense: {description} ({currency} {amount})",
-                    link=url_for('view_group', group_id=group_id, _external=True)
+                    link=group_link
                 )
                 db.session.add(notification)
 
-                # Send email notification if we have the participant's email
-                participant_user = User.query.get(participant_id)
-                if participant_user and participant_user.email:
-                    from utils import send_email
-
+                # Queue an email notification if we have the participant's email
+                if participant_user.email:
                     # Create HTML email content
                     html_content = f"""
                     <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
@@ -309,7 +336,7 @@ def add_expense(group_id):
                             <p><strong>Date:</strong> {date.strftime('%Y-%m-%d')}</p>
                         </div>
                         <p>View all group expenses and settlements:</p>
-                        <a href="{url_for('view_group', group_id=group_id, _external=True)}"
+                        <a href="{group_link}"
                            style="background-color: #007bff; color: white; padding: 10px 15px;
                                   text-decoration: none; border-radius: 4px; display: inline-block;">
                            View Details
@@ -317,14 +344,20 @@ def add_expense(group_id):
                     </div>
                     """
 
-                    # Send the email
-                    send_email(
-                        to_email=participant_user.email,
-                        subject=f"New Expense in {group.name}",
-                        html_content=html_content
-                    )
+                    emails.append({
+                        'to_email': participant_user.email,
+                        'subject': f"New Expense in {group.name}",
+                        'html_content': html_content,
+                        'event_key': f"expense-added:{expense.id}"
+                    })
+
+        # Emails are delivered by the outbox worker, not inside this request
+        queue_emails(emails)
 
         db.session.commit()
+
+        # Push the new notifications to open notification streams
+        notifier.publish(participant.id for participant in participant_users if participant.id != current_user.id)
         flash('Expense added successfully!', 'success')
         return redirect(url_for('view_group', group_id=group_id))
 
@@ -334,76 +367,64 @@ def add_expense(group_id):
                           exchange_rates=exchange_rates)
 
 @app.route('/groups/<group_id>/expenses')
+@read_replica
 @login_required
 def view_expenses(group_id):
-    group = Group.query.get(group_id)
-
-    if not group or current_user not in group.members_rel:
-        flash('Group not found or you are not a member!', 'danger')
-        return redirect(url_for('dashboard'))
-
     # Get show_settled parameter from query string (default: False)
     show_settled = request.args.get('show_settled', '').lower() in ('true', '1', 't', 'yes')
 
-    # Base query for expenses with payer information
-    query = db.session.query(
-        Expense, User.username.label('payer_name')
-    ).join(
-        User, Expense.payer == User.id
-    ).filter(
-        Expense.group_id == group_id
-    )
-
-    # Filter by settled status if needed
-    if not show_settled:
-        query = query.filter(Expense.settled == False)
-
-    # Get expenses ordered by date
-    expenses_with_payers = query.order_by(Expense.date.desc()).all()
-
-    # Format expenses for template
-    group_expenses = []
-    for expense, payer_name in expenses_with_payers:
-        expense.payer_name = payer_name
-
-        # Add settler information if the expense is settled
-        if expense.settled and expense.settled_by:
-            settler = User.query.get(expense.settled_by)
-            if settler:
-                expense.settler_name = settler.username
-            else:
-                expense.settler_name = "Unknown"
+    # Load one page of expenses; payer and settler names come from the member list
+    try:
+        snapshot, next_cursor = load_expense_page(group_id, show_settled, request.args.get('cursor'), get_page_size())
+    except ValueError:
+        flash('Invalid page requested!', 'danger')
+        return redirect(url_for('view_expenses', group_id=group_id, show_settled=show_settled))
 
-        group_expenses.append(expense)
+    if not snapshot or not snapshot.is_member(current_user.id):
+        flash('Group not found or you are not a member!', 'danger')
+        return redirect(url_for('dashboard'))
 
     return render_template('expenses.html',
-                          group=group,
-                          expenses=group_expenses,
-                          show_settled=show_settled)
+                          group=snapshot.group,
+                          members=snapshot.members,
+                          expenses=snapshot.expenses,
+                          show_settled=show_settled,
+                          next_cursor=next_cursor)
 
 @app.route('/groups/<group_id>/settlements')
+@read_replica
 @login_required
 def view_settlements(group_id):
-    group = Group.query.get(group_id)
+    # Load the group and its members
+    snapshot = load_group_snapshot(group_id)
 
-    if not group or current_user not in group.members_rel:
+    if not snapshot or not snapshot.is_member(current_user.id):
         flash('Group not found or you are not a member!', 'danger')
         return redirect(url_for('dashboard'))
 
-    # Get group members
-    group_members = group.members_rel.all()
-
-    # Get group expenses
-    group_expenses = Expense.query.filter_by(group_id=group_id).all()
+    group = snapshot.group
+    group_members = snapshot.members
 
     # Get display currency from query parameter or user preference
     display_currency = request.args.get('currency') or current_user.preferred_currency
 
+    # Nothing to do if the browser already has this version of the page
+    etag = group_etag(group, current_user, display_currency)
+    response = not_modified(etag)
+    if response:
+        return response
+
+    # Load the most recently settled expenses for reference
+    load_expenses(snapshot, 'settled', limit=5)
+
     # Get include_settled parameter from query string (default: False)
     include_settled = request.args.get('include_settled', '').lower() in ('true', '1', 't', 'yes')
 
-    # Calculate balances
-    balances = calculate_balances(group_id, group_expenses, group_members, display_currency, include_settled=include_settled)
+    # Calculate balances (the ledger only tracks unsettled expenses)
+    if include_settled:
+        balances = calculate_balances(group_id, None, group_members, display_currency, include_settled=True)
+    else:
+        balances = get_ledger_balances(group_id, group_members, display_currency)
 
     # Get settlement plan
     settlement_plan = get_settlement_plan(balances, display_currency)
@@ -411,100 +432,98 @@ def view_settlements(group_id):
     # Get all available currencies for the dropdown
     available_currencies = list(get_exchange_rates().keys())
 
-    # Get settled expenses for reference
-    settled_expenses = Expense.query.filter_by(group_id=group_id, settled=True).order_by(Expense.settled_at.desc()).all()
-
-    # Add settler information to settled expenses
-    for expense in settled_expenses:
-        if expense.settled_by:
-            settler = User.query.get(expense.settled_by)
-            if settler:
-                expense.settler_name = settler.username
-            else:
-                expense.settler_name = "Unknown"
-
-    return render_template('settlements.html',
+    return with_etag(make_response(render_template('settlements.html',
                           group=group,
+                          members=group_members,
                           balances=balances,
                           settlement_plan=settlement_plan,
                           display_currency=display_currency,
                           available_currencies=available_currencies,
                           include_settled=include_settled,
-                          settled_expenses=settled_expenses)
+                          settled_expenses=snapshot.expenses)), etag)
 
 # Export routes
 @app.route('/groups/<group_id>/export')
+@read_replica
 @login_required
 def export_group_data(group_id):
-    group = Group.query.get(group_id)
+    # Load the group and its members; expenses are streamed by the export itself
+    snapshot = load_group_snapshot(group_id)
 
-    if not group or current_user not in group.members_rel:
+    if not snapshot or not snapshot.is_member(current_user.id):
         flash('Group not found or you are not a member!', 'danger')
         return redirect(url_for('dashboard'))
 
-    # Get group members
-    group_members = {user.id: user for user in group.members_rel.all()}
-
-    # Get group expenses
-    group_expenses = Expense.query.filter_by(group_id=group_id).all()
-
-    # Create CSV file in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Write header
-    writer.writerow(['Date', 'Description', 'Amount', 'Currency', 'Paid By', 'Participants', 'Split Type'])
-
-    # Write expenses
-    for expense in group_expenses:
-        payer = User.query.get(expense.payer)
-        payer_name = payer.username if payer else "Unknown"
-
-        participants_names = [user.username for user in expense.participants]
-        split_type = 'Custom' if expense.get_custom_splits() else 'Equal'
-
-        writer.writerow([
-            expense.date.strftime('%Y-%m-%d'),
-            expense.description,
-            expense.amount,
-            expense.currency,
-            payer_name,
-            ', '.join(participants_names),
-            split_type
-        ])
-
-    # Calculate balances and add to CSV
-    writer.writerow([])
-    writer.writerow(['Balances'])
-    writer.writerow(['User', 'Net Balance'])
-
-    balances = calculate_balances(group_id, group_expenses, list(group_members.values()))
-    for user_id, balance in balances.items():
-        user = group_members.get(user_id)
-        user_name = user.username if user else "Unknown"
-        writer.writerow([user_name, balance])
-
-    # Add settlement plan
-    writer.writerow([])
-    writer.writerow(['Settlement Plan'])
-    writer.writerow(['From', 'To', 'Amount'])
-
-    settlement_plan = get_settlement_plan(balances)
-    for settlement in settlement_plan:
-        from_user = group_members.get(settlement['from'])
-        to_user = group_members.get(settlement['to'])
-        from_name = from_user.username if from_user else "Unknown"
-        to_name = to_user.username if to_user else "Unknown"
-        writer.writerow([from_name, to_name, settlement['amount']])
-
-    # Prepare response
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        download_name=f"{group.name}_expenses.csv",
-        as_attachment=True,
+    # Stream the CSV as it is written instead of building it in memory
+    response = Response(
+        stream_with_context(chunk.encode('utf-8') for chunk in generate_group_csv(snapshot)),
         mimetype='text/csv'
     )
+    download_name = f"{snapshot.group.name}_expenses.csv"
+    try:
+        download_name.encode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    except UnicodeEncodeError:
+        # Same fallback as send_file: an ASCII name plus the UTF-8 name for browsers that support it
+        ascii_name = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=ascii_name,
+                             **{'filename*': f"UTF-8''{quote(download_name)}"})
+    return response
+
+def run_import(snapshot, stream, filename=None, content_type=None):
+    """
+    Import expenses from an uploaded file into a group and notify the members involved.
+
+    Returns:
+        The import report from import_expenses
+    """
+    file_format = detect_format(request.values.get('format'), filename, content_type)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    report = import_expenses(
+        snapshot,
+        read_records(text, file_format),
+        current_user,
+        group_link=url_for('view_group', group_id=snapshot.group.id, _external=True),
+        chunk_size=app.config['IMPORT_CHUNK_SIZE'],
+        max_rows=app.config['IMPORT_MAX_ROWS']
+    )
+    notifier.publish(report['notified'])
+    return report
+
+@app.route('/groups/<group_id>/import', methods=['GET', 'POST'])
+@login_required
+def import_group_expenses(group_id):
+    snapshot = load_group_snapshot(group_id)
+
+    if not snapshot or not snapshot.is_member(current_user.id):
+        flash('Group not found or you are not a member!', 'danger')
+        return redirect(url_for('dashboard'))
+
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose a file to import!', 'danger')
+            return redirect(url_for('import_group_expenses', group_id=group_id))
+
+        try:
+            report = run_import(snapshot, upload.stream, upload.filename, upload.mimetype)
+        except ImportFormatError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('import_group_expenses', group_id=group_id))
+
+        if report['imported']:
+            flash(f"Imported {report['imported']} of {report['rows']} expenses.", 'success' if not report['errors'] else 'warning')
+        else:
+            flash('No expenses were imported.', 'danger')
+
+    return render_template(
+        'import_expenses.html',
+        group=snapshot.group,
+        report=report,
+        max_errors_shown=200
+    )
 
 # Expense settlement route
 @app.route('/expenses/<expense_id>/settle', methods=['POST'])
@@ -516,17 +535,26 @@ def settle_expense(expense_id):
         flash('Expense not found!', 'danger')
         return redirect(url_for('dashboard'))
 
-    group = Group.query.get(expense.group_id)
+    snapshot = load_group_snapshot(expense.group_id)
 
-    if not group or current_user not in group.members_rel:
+    if not snapshot or not snapshot.is_member(current_user.id):
         flash('Group not found or you are not a member!', 'danger')
         return redirect(url_for('dashboard'))
 
+    group = snapshot.group
+
+    if expense.settled:
+        flash('Expense is already settled!', 'info')
+        return redirect(request.referrer or url_for('view_group', group_id=expense.group_id))
+
     # Mark the expense as settled
     expense.settled = True
     expense.settled_at = datetime.now()
     expense.settled_by = current_user.id
 
+    # Remove the expense from the group's balance ledger in the same transaction
+    apply_expense_to_ledger(expense, direction=-1)
+
     # Create notifications for all participants
     for participant in expense.participants:
         if participant.id != current_user.id:
@@ -540,6 +568,9 @@ def settle_expense(expense_id):
 
     db.session.commit()
 
+    # Push the new notifications to open notification streams
+    notifier.publish(participant.id for participant in expense.participants if participant.id != current_user.id)
+
     flash('Expense marked as settled!', 'success')
 
     # Redirect back to the referring page
@@ -549,21 +580,122 @@ def settle_expense(expense_id):
     else:
         return redirect(url_for('view_group', group_id=expense.group_id))
 
+def run_bulk_settle(snapshot, scope, expense_ids=None, between=None):
+    """
+    Settle several of a group's open expenses at once and notify each participant once.
+
+    Args:
+        snapshot: GroupSnapshot of the group with its members
+        scope: 'all', 'selected' (the given expense IDs) or 'between' (two members)
+        expense_ids: Expense IDs for the 'selected' scope
+        between: Pair of user IDs for the 'between' scope; only expenses shared by
+            just those two are settled
+
+    Returns:
+        The IDs of the settled expenses
+
+    Raises:
+        ValueError: If the scope or its arguments are invalid
+    """
+    if scope == 'all':
+        expense_ids = between = None
+    elif scope == 'selected':
+        if not expense_ids:
+            raise ValueError('No expenses selected')
+        between = None
+    elif scope == 'between':
+        if not between or len(set(between)) != 2 or not all(snapshot.is_member(user_id) for user_id in between):
+            raise ValueError('Choose two different members of the group')
+        expense_ids = None
+    else:
+        raise ValueError('Invalid settle scope')
+
+    settled_ids, participants = settle_expenses(snapshot.group.id, current_user.id, expense_ids, between)
+
+    # One notification per participant, however many of their expenses were settled
+    notified = sorted(participants - {current_user.id})
+    if settled_ids:
+        add_notifications(
+            notified,
+            title=f"Expenses Settled in {snapshot.group.name}",
+            message=f"{current_user.username} marked {len(settled_ids)} expense{'s' if len(settled_ids) != 1 else ''} as settled",
+            link=url_for('view_group', group_id=snapshot.group.id, _external=True)
+        )
+    db.session.commit()
+
+    # Push the new notifications to open notification streams
+    notifier.publish(notified)
+    return settled_ids
+
+@app.route('/groups/<group_id>/settle', methods=['POST'])
+@login_required
+def settle_group_expenses(group_id):
+    snapshot = load_group_snapshot(group_id)
+
+    if not snapshot or not snapshot.is_member(current_user.id):
+        flash('Group not found or you are not a member!', 'danger')
+        return redirect(url_for('dashboard'))
+
+    # "Settle with" a member means the expenses between them and the current user
+    between = None
+    if request.form.get('user_id'):
+        between = (current_user.id, request.form.get('user_id'))
+
+    try:
+        settled_ids = run_bulk_settle(
+            snapshot,
+            request.form.get('scope'),
+            expense_ids=request.form.getlist('expense_ids'),
+            between=between
+        )
+    except ValueError as e:
+        flash(f'{e}!', 'danger')
+        return redirect(request.referrer or url_for('view_expenses', group_id=group_id))
+
+    if settled_ids:
+        flash(f"Marked {len(settled_ids)} expense{'s' if len(settled_ids) != 1 else ''} as settled!", 'success')
+    else:
+        flash('There were no open expenses to settle.', 'info')
+
+    return redirect(request.referrer or url_for('view_expenses', group_id=group_id))
+
 # Notification routes
 @app.route('/notifications')
 @login_required
 def view_notifications():
-    user_notifications = Notification.query.filter_by(user_id=current_user.id).all()
+    cursor = request.args.get('cursor')
 
-    # Mark all as read
-    for notification in user_notifications:
-        notification.read = True
+    # Mark all as read with one UPDATE when the list is opened
+    if not cursor:
+        mark_notifications_read(current_user.id)
+        db.session.commit()
 
-    db.session.commit()
+    # Load one page, newest first
+    try:
+        user_notifications, next_cursor = get_notification_page(
+            current_user.id, cursor, app.config['NOTIFICATION_PAGE_SIZE']
+        )
+    except ValueError:
+        flash('Invalid page requested!', 'danger')
+        return redirect(url_for('view_notifications'))
 
-    return render_template('notifications.html', notifications=user_notifications)
+    return render_template('notifications.html',
+                          notifications=user_notifications,
+                          next_cursor=next_cursor)
 
 # API routes for AJAX requests
+@app.route('/metrics')
+def metrics_endpoint():
+    # Metrics are only served with a bearer token, so without one configured the endpoint doesn't exist
+    token = app.config.get('METRICS_TOKEN')
+    if not token:
+        return Response('Not Found\n', status=404, mimetype='text/plain')
+    authorization = request.headers.get('Authorization', '').encode('utf-8')
+    if not hmac.compare_digest(authorization, f"Bearer {token}".encode('utf-8')):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/exchange-rates')
 def api_exchange_rates():
     rates = get_exchange_rates()
@@ -575,8 +707,9 @@ def set_preferred_currency():
     """Set the user's preferred currency."""
     currency = request.json.get('currency')
     if currency:
-        current_user.preferred_currency = currency
+        current_user.record().preferred_currency = currency
         db.session.commit()
+        invalidate_user(current_user.id)
         return jsonify({"success": True, "message": f"Currency set to {currency}"})
     return jsonify({"success": False, "message": "Invalid currency"}), 400
 
@@ -584,36 +717,170 @@ def set_preferred_currency():
 @login_required
 def api_unread_notifications():
     """API endpoint to get unread notifications for the current user."""
-    user_notifications = Notification.query.filter_by(user_id=current_user.id, read=False).all()
-    unread_notifications = [n.to_dict() for n in user_notifications]
+    return jsonify({"notifications": take_unread_notifications(current_user.id)})
 
-    # Mark as read after fetching
-    for notification in user_notifications:
-        notification.read = True
+@app.route('/api/notifications/stream')
+@login_required
+def notification_stream():
+    """
+    Server-Sent Events stream that pushes new notifications as they are created.
+    The stream ends after NOTIFICATION_STREAM_TIMEOUT and the browser reconnects;
+    when streams are disabled or this worker is full, the client falls back to polling.
+    """
+    if not app.config['NOTIFICATION_STREAM_ENABLED']:
+        return jsonify({'error': 'Notification stream is disabled'}), 503
+
+    try:
+        subscription = notifier.get_hub().subscribe(current_user.id)
+    except notifier.StreamLimitReached:
+        return jsonify({'error': 'Too many open notification streams'}), 503
+
+    user_id = current_user.id
+    timeout = app.config['NOTIFICATION_STREAM_TIMEOUT']
+    heartbeat = app.config['NOTIFICATION_STREAM_HEARTBEAT']
+
+    def events():
+        # Don't hold a database connection while the stream is idle
+        db.session.remove()
+
+        # Tell the browser how soon to reconnect when the stream ends
+        yield "retry: 1000\n\n"
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            if subscription.wait(min(heartbeat, remaining)):
+                notifications = take_unread_notifications(user_id)
+                db.session.remove()
+                if notifications:
+                    yield f"data: {json.dumps({'notifications': notifications}, default=str)}\n\n"
+            else:
+                yield ": keep-alive\n\n"
 
-    db.session.commit()
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    # Free the slot when the response is closed, even if the stream never started
+    # (e.g. a HEAD request, or a client that disconnected first)
+    response.call_on_close(lambda: notifier.get_hub().unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let a proxy buffer the stream
+    return response
+
+@app.route('/api/me/balance-summary')
+@login_required
+def api_balance_summary():
+    """API endpoint to get the current user's net position across all groups."""
+    # Get display currency from query parameter or user preference
+    display_currency = request.args.get('currency') or current_user.preferred_currency
+
+    return jsonify(get_user_position(current_user.id, display_currency))
+
+@app.route('/api/groups/<group_id>/expenses')
+@read_replica
+@login_required
+def api_group_expenses(group_id):
+    show_settled = request.args.get('show_settled', '').lower() in ('true', '1', 't', 'yes')
+
+    try:
+        snapshot, next_cursor = load_expense_page(group_id, show_settled, request.args.get('cursor'), get_page_size())
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    if not snapshot or not snapshot.is_member(current_user.id):
+        return jsonify({'error': 'Group not found or you are not a member'}), 403
 
-    return jsonify({"notifications": unread_notifications})
+    expenses_data = []
+    for expense in snapshot.expenses:
+        expenses_data.append({
+            'id': expense.id,
+            'date': expense.date.isoformat(),
+            'description': expense.description,
+            'amount': expense.amount,
+            'currency': expense.currency,
+            'payer': expense.payer,
+            'payer_name': expense.payer_name,
+            'participants': [user.id for user in expense.participants],
+            'split_type': 'custom' if expense.custom_splits else 'equal',
+            'settled': bool(expense.settled),
+            'settled_at': expense.settled_at.isoformat() if expense.settled_at else None,
+            'settled_by': expense.settled_by
+        })
+
+    return jsonify({
+        'expenses': expenses_data,
+        'next_cursor': next_cursor,
+        # Rendered table rows for the "load more" button on the expenses page
+        'html': render_template('expense_rows.html', expenses=snapshot.expenses)
+    })
+
+@app.route('/api/groups/<group_id>/import', methods=['POST'])
+@login_required
+def api_import_group_expenses(group_id):
+    snapshot = load_group_snapshot(group_id)
+
+    if not snapshot or not snapshot.is_member(current_user.id):
+        return jsonify({'error': 'Group not found or you are not a member'}), 403
+
+    # Accept a multipart upload or the file as the request body
+    upload = request.files.get('file')
+    try:
+        if upload:
+            report = run_import(snapshot, upload.stream, upload.filename, upload.mimetype)
+        else:
+            report = run_import(snapshot, request.stream, content_type=request.mimetype)
+    except ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(report), 200 if report['imported'] or not report['errors'] else 422
+
+@app.route('/api/groups/<group_id>/settle', methods=['POST'])
+@login_required
+def api_settle_group_expenses(group_id):
+    snapshot = load_group_snapshot(group_id)
+
+    if not snapshot or not snapshot.is_member(current_user.id):
+        return jsonify({'error': 'Group not found or you are not a member'}), 403
+
+    data = request.get_json(silent=True) or {}
+    expense_ids = data.get('expense_ids')
+    between = data.get('between')
+    if expense_ids is not None and not (isinstance(expense_ids, list) and all(isinstance(expense_id, str) for expense_id in expense_ids)):
+        return jsonify({'error': 'expense_ids must be a list of expense IDs'}), 400
+    if between is not None and not (isinstance(between, list) and len(between) == 2 and all(isinstance(user_id, str) for user_id in between)):
+        return jsonify({'error': 'between must be a list of two user IDs'}), 400
+
+    try:
+        settled_ids = run_bulk_settle(snapshot, data.get('scope'), expense_ids, between)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'settled': len(settled_ids), 'expense_ids': settled_ids})
 
 @app.route('/api/groups/<group_id>/balance-data')
+@read_replica
 @login_required
 def api_group_balance_data(group_id):
-    group = Group.query.get(group_id)
+    snapshot = load_group_snapshot(group_id)
 
-    if not group or current_user not in group.members_rel:
+    if not snapshot or not snapshot.is_member(current_user.id):
         return jsonify({'error': 'Group not found or you are not a member'}), 403
 
     # Get group members
-    group_members = group.members_rel.all()
-
-    # Get group expenses
-    group_expenses = Expense.query.filter_by(group_id=group_id).all()
+    group_members = snapshot.members
 
     # Get display currency from query parameter or user preference
     display_currency = request.args.get('currency') or current_user.preferred_currency
 
-    # Calculate balances
-    balances = calculate_balances(group_id, group_expenses, group_members, display_currency)
+    # Nothing to do if the client already has this version of the data
+    etag = group_etag(snapshot.group, current_user, display_currency, page=False)
+    response = not_modified(etag, page=False)
+    if response:
+        return response
+
+    # Read balances from the ledger
+    balances = get_ledger_balances(group_id, group_members, display_currency)
 
     # Format data for Chart.js
     labels = []
@@ -626,8 +893,7 @@ def api_group_balance_data(group_id):
     if display_currency:
         # Single currency format
         for user_id, amount in balances.items():
-            user = User.query.get(user_id)
-            username = user.username if user else "Unknown"
+            username = snapshot.username(user_id)
 
             # Add user to formatted balances with single currency
             formatted_balances[username] = amount
@@ -646,8 +912,7 @@ def api_group_balance_data(group_id):
     else:
         # Multi-currency format (original implementation)
         for user_id, user_balances in balances.items():
-            user = User.query.get(user_id)
-            username = user.username if user else "Unknown"
+            username = snapshot.username(user_id)
 
             # Add user to formatted balances
             formatted_balances[username] = {}
@@ -678,7 +943,7 @@ def api_group_balance_data(group_id):
     # Get all available currencies for the dropdown
     available_currencies = list(get_exchange_rates().keys())
 
-    return jsonify({
+    return with_etag(jsonify({
         'labels': labels,
         'datasets': [{
             'data': data,
@@ -688,4 +953,4 @@ def api_group_balance_data(group_id):
         'balances': formatted_balances,
         'display_currency': display_currency,
         'available_currencies': available_currencies
-    })
+    }), etag)
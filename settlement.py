@@ -0,0 +1,190 @@
+"""
+Settlement solver: turns net balances into a list of transfers.
+
+Small groups are solved exactly for the minimum number of transfers by
+partitioning the balances into as many zero-sum subsets as possible (every
+subset of k people can be settled with k - 1 transfers). The search is
+exponential in the number of people with a non-zero balance, so it only runs
+below a size limit and within a wall-clock/iteration budget. Everything else
+falls back to a heap-based greedy matcher that runs in O(n log n).
+"""
+
+import heapq
+import time
+
+from money import from_minor
+
+EXACT = 'exact'
+GREEDY = 'greedy'
+
+DEFAULT_EXACT_MAX_MEMBERS = 12
+DEFAULT_TIME_BUDGET = 0.05  # seconds
+DEFAULT_MAX_ITERATIONS = 200000
+
+class BudgetExceeded(Exception):
+    """Raised when the exact search runs out of its time or iteration budget."""
+
+def solve(balances, currency, exact_max_members=DEFAULT_EXACT_MAX_MEMBERS,
+          time_budget=DEFAULT_TIME_BUDGET, max_iterations=DEFAULT_MAX_ITERATIONS):
+    """
+    Generate the transfers needed to settle the balances of one currency.
+
+    Args:
+        balances: Dictionary mapping user_id to an integer amount in minor units
+            (positive if owed, negative if owing)
+        currency: Currency code attached to every transfer
+        exact_max_members: Largest number of non-zero balances solved exactly
+        time_budget: Wall-clock budget in seconds for the exact search
+        max_iterations: Iteration budget for the exact search
+
+    Returns:
+        A dictionary: {'transfers': [{'from', 'to', 'amount', 'currency'}],
+                       'strategy': 'exact' or 'greedy', 'elapsed_ms': float}
+    """
+    started = time.perf_counter()
+
+    # Integer amounts let subsets sum to exactly zero
+    people = []
+    amounts = []
+    for user_id, balance in balances.items():
+        if balance:
+            people.append(user_id)
+            amounts.append(balance)
+
+    strategy = GREEDY
+    transfers = None
+    if len(people) <= exact_max_members:
+        try:
+            transfers = _solve_exact(amounts, started + time_budget, max_iterations)
+            strategy = EXACT
+        except BudgetExceeded:
+            transfers = None
+
+    if transfers is None:
+        transfers = _solve_greedy(list(range(len(people))), amounts)
+
+    return {
+        'transfers': [
+            {
+                'from': people[debtor],
+                'to': people[creditor],
+                'amount': from_minor(amount, currency),
+                'currency': currency
+            }
+            for debtor, creditor, amount in transfers
+        ],
+        'strategy': strategy,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+    }
+
+def _solve_exact(amounts, deadline, max_iterations):
+    """
+    Find the partition of balances into the largest number of zero-sum subsets
+    and settle each subset greedily.
+
+    Returns:
+        A list of (debtor_index, creditor_index, amount) tuples
+    """
+    n = len(amounts)
+    full = (1 << n) - 1
+
+    # subset_sum[mask] is the total balance of the people in mask
+    subset_sum = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        subset_sum[mask] = subset_sum[mask ^ low] + amounts[low.bit_length() - 1]
+
+    # zero_sets[mask] is the most zero-sum subsets the people in mask can be split into
+    zero_sets = [0] * (full + 1)
+    iterations = 0
+    for mask in range(1, full + 1):
+        best = 0
+        remaining = mask
+        while remaining:
+            low = remaining & -remaining
+            if zero_sets[mask ^ low] > best:
+                best = zero_sets[mask ^ low]
+            remaining ^= low
+        zero_sets[mask] = best + (subset_sum[mask] == 0)
+
+        iterations += n
+        if iterations > max_iterations or (mask & 1023 == 0 and time.perf_counter() > deadline):
+            raise BudgetExceeded()
+
+    # Walk back from the full set to recover the order people were added in;
+    # every time the running total returns to zero a subset is closed
+    order = []
+    mask = full
+    while mask:
+        target = zero_sets[mask] - (subset_sum[mask] == 0)
+        remaining = mask
+        while remaining:
+            low = remaining & -remaining
+            if zero_sets[mask ^ low] == target:
+                break
+            remaining ^= low
+        order.append(low.bit_length() - 1)
+        mask ^= low
+    order.reverse()
+
+    transfers = []
+    subset = []
+    running = 0
+    for index in order:
+        subset.append(index)
+        running += amounts[index]
+        if running == 0:
+            transfers.extend(_solve_greedy(subset, amounts))
+            subset = []
+    if subset:
+        transfers.extend(_solve_greedy(subset, amounts))
+
+    return transfers
+
+def _solve_greedy(indexes, amounts):
+    """
+    Settle balances by repeatedly matching the largest debtor with the largest creditor.
+    Debtors and creditors with exactly matching amounts are paired first.
+
+    Returns:
+        A list of (debtor_index, creditor_index, amount) tuples
+    """
+    transfers = []
+
+    # Pair up exact matches, which settle two people with one transfer
+    creditors_by_amount = {}
+    for index in indexes:
+        if amounts[index] > 0:
+            creditors_by_amount.setdefault(amounts[index], []).append(index)
+
+    debtors = []  # max-heap of (-debt, index)
+    matched = set()
+    for index in indexes:
+        if amounts[index] < 0:
+            candidates = creditors_by_amount.get(-amounts[index])
+            if candidates:
+                creditor = candidates.pop()
+                matched.add(creditor)
+                transfers.append((index, creditor, -amounts[index]))
+            else:
+                debtors.append((amounts[index], index))
+
+    creditors = [(-amounts[index], index) for index in indexes
+                 if amounts[index] > 0 and index not in matched]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    while debtors and creditors:
+        debt, debtor = heapq.heappop(debtors)
+        credit, creditor = heapq.heappop(creditors)
+
+        amount = min(-debt, -credit)
+        transfers.append((debtor, creditor, amount))
+
+        # Push back whoever still has a remaining balance
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+
+    return transfers
@@ -0,0 +1,192 @@
+"""
+Group snapshot loader for the group-scoped routes.
+
+Loads a group, its members and (optionally) its expenses with participants in
+a fixed number of queries, and resolves payer and settler names from the
+member list instead of querying users one by one.
+"""
+
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import selectinload
+
+from models import db, User, Group, Expense, group_members
+
+class GroupSnapshot:
+    """
+    A group with everything a page needs already loaded.
+
+    Attributes:
+        group: The Group object
+        members: List of member User objects
+        members_by_id: Dictionary mapping user_id to member
+        expenses: List of Expense objects with participants loaded, or None if not requested
+    """
+
+    def __init__(self, group, members, expenses=None):
+        self.group = group
+        self.members = members
+        self.members_by_id = {member.id: member for member in members}
+        self.expenses = expenses
+
+    def is_member(self, user_id):
+        return user_id in self.members_by_id
+
+    def username(self, user_id, default="Unknown"):
+        member = self.members_by_id.get(user_id)
+        return member.username if member else default
+
+def load_group_snapshot(group_id, expenses=None, limit=None, after=None):
+    """
+    Load a group with its members and, optionally, its expenses.
+
+    Queries: one for the group, one for the members and, when expenses are
+    requested, one for the expenses plus one for all of their participants.
+
+    Args:
+        group_id: The ID of the group
+        expenses: Which expenses to load: None (don't load), 'all', 'open' or 'settled'.
+            Settled expenses are ordered by settled_at, others by (date, id) (newest first)
+        limit: Optional maximum number of expenses to load
+        after: Optional (date, id) keyset position; only expenses after it in
+            (date, id) order are loaded. Not used for 'settled'
+
+    Returns:
+        A GroupSnapshot, or None if the group does not exist
+    """
+    group = Group.query.get(group_id)
+    if not group:
+        return None
+
+    members = User.query.join(
+        group_members, group_members.c.user_id == User.id
+    ).filter(
+        group_members.c.group_id == group_id
+    ).all()
+
+    snapshot = GroupSnapshot(group, members)
+
+    if expenses:
+        load_expenses(snapshot, expenses, limit, after)
+
+    return snapshot
+
+def load_expenses(snapshot, expenses='all', limit=None, after=None):
+    """
+    Load expenses onto a snapshot loaded without them, e.g. after checking that
+    the page has changed at all. Arguments are the same as for load_group_snapshot.
+
+    Returns:
+        The list of expenses, also set as snapshot.expenses
+    """
+    query = Expense.query.options(
+        selectinload(Expense.participants)
+    ).filter(
+        Expense.group_id == snapshot.group.id
+    )
+
+    if expenses == 'open':
+        query = query.filter(Expense.settled == False)
+    elif expenses == 'settled':
+        query = query.filter(Expense.settled == True)
+
+    if expenses == 'settled':
+        query = query.order_by(Expense.settled_at.desc())
+    else:
+        if after:
+            after_date, after_id = after
+            query = query.filter(or_(
+                Expense.date < after_date,
+                and_(Expense.date == after_date, Expense.id < after_id)
+            ))
+        query = query.order_by(Expense.date.desc(), Expense.id.desc())
+
+    if limit:
+        query = query.limit(limit)
+
+    snapshot.expenses = query.all()
+    attach_names(snapshot, snapshot.expenses)
+    return snapshot.expenses
+
+def load_expense_page(group_id, show_settled=False, cursor=None, page_size=50):
+    """
+    Load one page of a group's expenses, newest first, using keyset pagination on
+    (Expense.date, Expense.id) so each page costs the same however deep it is.
+
+    Args:
+        group_id: The ID of the group
+        show_settled: Whether to include settled expenses
+        cursor: Cursor returned with the previous page, or None for the first page
+        page_size: Number of expenses per page
+
+    Returns:
+        A tuple (snapshot, next_cursor); snapshot is None if the group does not
+        exist and next_cursor is None on the last page
+
+    Raises:
+        ValueError: If the cursor is not valid
+    """
+    after = decode_cursor(cursor) if cursor else None
+
+    # Fetch one extra row to find out whether there is another page
+    snapshot = load_group_snapshot(group_id, expenses='all' if show_settled else 'open',
+                                   limit=page_size + 1, after=after)
+    if not snapshot:
+        return None, None
+
+    next_cursor = None
+    if len(snapshot.expenses) > page_size:
+        snapshot.expenses = snapshot.expenses[:page_size]
+        next_cursor = encode_cursor(snapshot.expenses[-1])
+
+    return snapshot, next_cursor
+
+def encode_cursor(expense):
+    """Encode an expense's (date, id) position as an opaque URL-safe cursor."""
+    return encode_position(expense.date, expense.id)
+
+def encode_position(timestamp, row_id):
+    """Encode a (timestamp, id) keyset position as an opaque URL-safe cursor."""
+    position = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by encode_cursor or encode_position.
+
+    Returns:
+        A tuple (date, id)
+
+    Raises:
+        ValueError: If the cursor is not valid
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        date, expense_id = position.split('|', 1)
+        return datetime.fromisoformat(date), expense_id
+    except (UnicodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def attach_names(snapshot, expenses):
+    """
+    Set payer_name and settler_name on expenses for the templates. Names are taken
+    from the member list; anyone who is no longer a member is looked up in one query.
+    """
+    user_ids = set()
+    for expense in expenses:
+        user_ids.add(expense.payer)
+        if expense.settled_by:
+            user_ids.add(expense.settled_by)
+
+    names = {user_id: snapshot.members_by_id[user_id].username
+             for user_id in user_ids if user_id in snapshot.members_by_id}
+    missing = user_ids - set(names)
+    if missing:
+        names.update(db.session.query(User.id, User.username).filter(User.id.in_(missing)).all())
+
+    for expense in expenses:
+        expense.payer_name = names.get(expense.payer, "Unknown")
+        if expense.settled and expense.settled_by:
+            expense.settler_name = names.get(expense.settled_by, "Unknown")
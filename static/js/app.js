@@ -66,24 +66,53 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    // Check for new notifications via API every 30 seconds
+    function showNotifications(data) {
+        if (data.notifications && data.notifications.length > 0) {
+            data.notifications.forEach(notification => {
+                showToastNotification(
+                    notification.title,
+                    notification.message,
+                    notification.link
+                );
+            });
+        }
+    }
+
+    // Check for new notifications via API (fallback when the stream is unavailable)
     function checkForNewNotifications() {
         fetch('/api/notifications/unread')
             .then(response => response.json())
-            .then(data => {
-                if (data.notifications && data.notifications.length > 0) {
-                    data.notifications.forEach(notification => {
-                        showToastNotification(
-                            notification.title,
-                            notification.message,
-                            notification.link
-                        );
-                    });
-                }
-            })
+            .then(showNotifications)
             .catch(error => console.error('Error checking notifications:', error));
     }
 
+    let pollingTimer = null;
+    function startPolling() {
+        if (!pollingTimer) {
+            pollingTimer = setInterval(checkForNewNotifications, 30000); // Check every 30 seconds
+        }
+    }
+
+    // Receive new notifications as they are created over Server-Sent Events.
+    // The browser reconnects on its own when the server ends the stream; if the
+    // server refuses the stream (disabled or busy) we fall back to polling.
+    function connectNotificationStream() {
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+
+        const source = new EventSource('/api/notifications/stream');
+        source.onmessage = function(event) {
+            showNotifications(JSON.parse(event.data));
+        };
+        source.onerror = function() {
+            if (source.readyState === EventSource.CLOSED) {
+                startPolling();
+            }
+        };
+    }
+
     // Show any initial unread notifications passed from server
     const notificationsData = window.notificationsData || [];
     if (notificationsData.length > 0) {
@@ -96,8 +125,10 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    // Set interval to check for new notifications
-    setInterval(checkForNewNotifications, 30000); // Check every 30 seconds
+    // Listen for new notifications when signed in
+    if (window.notificationsData) {
+        connectNotificationStream();
+    }
 
     // Handle currency conversion in add expense form
     const currencySelect = document.getElementById('currency');
@@ -0,0 +1,68 @@
+"""
+Regression tests for bulk settling between two members.
+"""
+
+import os
+import tempfile
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_PATH
+
+import main  # noqa: E402,F401
+from app import app, db  # noqa: E402
+from models import BalanceLedger, Expense, Group  # noqa: E402
+
+app.config['TESTING'] = True
+
+with app.app_context():
+    db.create_all()
+
+def _client(username):
+    client = app.test_client()
+    client.post('/register', data=dict(username=username, email=f'{username}@example.com',
+                                       password='pw', confirm_password='pw'))
+    client.post('/login', data=dict(username=username, password='pw'))
+    return client
+
+def _add_expense(client, group_id, description, payer, participants):
+    response = client.post(f'/groups/{group_id}/add-expense', data=dict(
+        amount='30', description=description, date='2025-01-01', payer=payer,
+        currency='USD', split_type='equal', participants=participants
+    ))
+    assert response.status_code == 302
+
+def test_settle_between_keeps_third_party_shares():
+    alice, bob, carol = _client('alice'), _client('bob'), _client('carol')
+    group_id = alice.post('/groups/create', data=dict(group_name='Trip')).headers['Location'].rsplit('/', 1)[1]
+    with app.app_context():
+        invite_code = db.session.get(Group, group_id).invite_code
+    for client in (bob, carol):
+        client.post('/groups/join', data=dict(invite_code=invite_code))
+
+    # Shared by all three, and one between alice and bob only
+    _add_expense(alice, group_id, 'Dinner', 'alice', ['alice', 'bob', 'carol'])
+    _add_expense(alice, group_id, 'Taxi', 'alice', ['alice', 'bob'])
+
+    response = alice.post(f'/api/groups/{group_id}/settle', json={'scope': 'between', 'between': ['alice', 'bob']})
+    assert response.status_code == 200
+    assert response.get_json()['settled'] == 1
+
+    with app.app_context():
+        settled = {expense.description: expense.settled for expense in Expense.query.filter_by(group_id=group_id)}
+        assert settled == {'Dinner': False, 'Taxi': True}
+
+        ledger = {row.user_id: row.net_minor for row in BalanceLedger.query.filter_by(group_id=group_id, currency='USD')}
+        assert ledger == {'alice': 2000, 'bob': -1000, 'carol': -1000}
+
+    balances = alice.get(f'/api/groups/{group_id}/balance-data').get_json()['balances']
+    assert balances['carol'] == -10.0
+
+def test_settle_between_rejects_malformed_pairs():
+    alice = app.test_client()
+    alice.post('/login', data=dict(username='alice', password='pw'))
+    with app.app_context():
+        group_id = Group.query.filter_by(name='Trip').first().id
+
+    for between in ([['alice'], ['bob']], [{'a': 1}, {'b': 2}], ['alice'], ['alice', 'bob', 'carol'], 'alice,bob'):
+        response = alice.post(f'/api/groups/{group_id}/settle', json={'scope': 'between', 'between': between})
+        assert response.status_code == 400, between
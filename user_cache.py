@@ -0,0 +1,146 @@
+"""
+Per-worker cache of logged-in users.
+
+Flask-Login loads the user on every authenticated request. Instead of a User
+row, load_user returns a CachedUser holding the user's identity, preferred
+currency and group ids, kept in a small LRU cache for USER_CACHE_TTL seconds.
+Anything else (relationships, the password hash) is read from the User row on
+first use.
+
+An entry is dropped when the user changes their profile or group membership
+(see invalidate_user). The change also stamps the user's session, so workers
+holding an older entry reload it on the user's next request. Other browsers
+logged in as the same user may see the old values until the entry expires.
+Membership only ever grows, so a group id missing from the cache is checked
+against the database before access is refused.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, has_request_context, session
+from flask_login import UserMixin
+
+from models import db, User, group_members
+
+SESSION_STAMP_KEY = '_user_stamp'
+
+_Entry = namedtuple('_Entry', 'id username email preferred_currency group_ids stamp loaded_at')
+
+class UserCache:
+    """A thread-safe LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.loaded_at > self.ttl:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry
+
+    def put(self, entry):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[entry.id] = entry
+            self._entries.move_to_end(entry.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+# Created lazily, so each worker process gets its own
+_cache = None
+_cache_lock = threading.Lock()
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UserCache(current_app.config['USER_CACHE_SIZE'], current_app.config['USER_CACHE_TTL'])
+    return _cache
+
+class CachedUser(UserMixin):
+    """
+    The logged-in user as cached by load_user. Compares equal to the User with
+    the same id. Attributes not cached here are read from the User row.
+    """
+
+    def __init__(self, entry):
+        self.id = entry.id
+        self.username = entry.username
+        self.email = entry.email
+        self.preferred_currency = entry.preferred_currency
+        self.group_ids = entry.group_ids
+
+    def record(self):
+        """Get the User row, e.g. to change it or add it to a relationship."""
+        return db.session.get(User, self.id)
+
+    def is_member(self, group_id):
+        """Check whether the user belongs to a group, asking the database only on a cache miss."""
+        if group_id in self.group_ids:
+            return True
+
+        found = db.session.query(group_members.c.group_id).filter(
+            group_members.c.group_id == group_id,
+            group_members.c.user_id == self.id
+        ).first() is not None
+        if found:
+            # Joined in another browser or worker; pick it up on the next request
+            _get_cache().discard(self.id)
+        return found
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.record(), name)
+
+def load_user(user_id):
+    """
+    Flask-Login user loader.
+
+    Returns:
+        A CachedUser, or None if the user does not exist
+    """
+    cache = _get_cache()
+    stamp = session.get(SESSION_STAMP_KEY)
+
+    entry = cache.get(user_id)
+    if entry is None or entry.stamp != stamp:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+
+        group_ids = frozenset(group_id for (group_id,) in db.session.query(
+            group_members.c.group_id
+        ).filter(
+            group_members.c.user_id == user_id
+        ))
+        entry = _Entry(user.id, user.username, user.email, user.preferred_currency,
+                       group_ids, stamp, time.monotonic())
+        cache.put(entry)
+
+    return CachedUser(entry)
+
+def invalidate_user(user_id):
+    """Drop a user's cached entry after their profile or group membership changed."""
+    _get_cache().discard(user_id)
+
+    # Make the other workers reload it on this browser's next request
+    if has_request_context():
+        session[SESSION_STAMP_KEY] = uuid.uuid4().hex
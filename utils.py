@@ -1,7 +1,19 @@
-import requests
-import resend
+import logging
+import uuid
 from collections import defaultdict
 from datetime import datetime
+from sqlalchemy import and_, case, exists, func, insert, or_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload
+
+import settlement
+from metrics import span
+from money import MinorLedger, from_minor, to_minor
+from models import db, User, Group, Expense, ExpenseShare, BalanceLedger, SettlementEdge, Notification, expense_participants
+from snapshot import decode_cursor, encode_position
+
+logger = logging.getLogger(__name__)
 
 def calculate_balances(group_id, expenses, members, display_currency=None, include_settled=False):
     """
@@ -11,7 +23,8 @@ def calculate_balances(group_id, expenses, members, display_currency=None, inclu
 
     Args:
         group_id: The ID of the group
-        expenses: List of expense objects
+        expenses: List of expense objects, or None to aggregate the stored
+            expense shares in the database instead of loading expenses
         members: List of member objects
         display_currency: Optional currency to convert all balances to
         include_settled: Whether to include settled expenses in the calculation (default: False)
@@ -22,65 +35,405 @@ def calculate_balances(group_id, expenses, members, display_currency=None, inclu
         If display_currency is specified:
             A dictionary mapping user_id to a single amount in the display currency
     """
-    # Initialize balances for all members with amount and currency
-    balances = {}
-    for member in members:
-        balances[member.id] = {}
+    # One integer minor-unit column per currency, indexed by member position
+    ledger = MinorLedger(member.id for member in members)
 
-    # Group expenses by currency
-    currency_expenses = {}
-    for expense in expenses:
-        # Skip settled expenses if include_settled is False
-        if not include_settled and expense.settled:
-            continue
+    if expenses is None:
+        # Let the database sum up the nets per user and currency
+        for user_id, currency, amount in aggregate_balances(group_id, include_settled):
+            ledger.add(currency, user_id, int(amount))
+    else:
+        # Visit each expense once and accumulate every participant's share per currency
+        for expense in expenses:
+            # Skip settled expenses if include_settled is False
+            if not include_settled and expense.settled:
+                continue
+
+            if expense.group_id != group_id:
+                continue
 
-        if expense.group_id == group_id:
-            currency = expense.currency
-            if currency not in currency_expenses:
-                currency_expenses[currency] = []
-            currency_expenses[currency].append(expense)
-
-    # Calculate balances for each currency
-    for currency, curr_expenses in currency_expenses.items():
-        for member in members:
-            member_id = member.id
-            if currency not in balances[member_id]:
-                balances[member_id][currency] = 0
-
-            for expense in curr_expenses:
-                # Add the split for this user (positive if they're owed, negative if they owe)
-                split = expense.get_split_for_user(member_id)
-                balances[member_id][currency] += split['amount']
-
-    # Round balances to two decimal places
-    for member_id in balances:
-        for currency in balances[member_id]:
-            balances[member_id][currency] = round(balances[member_id][currency], 2)
+            for user_id, amount in expense.get_minor_shares().items():
+                # Positive if they're owed, negative if they owe
+                ledger.add(expense.currency, user_id, amount)
+
+    # Every member gets an entry for every currency used in the group
+    balances = ledger.to_balances()
 
     # If a display currency is specified, convert all balances to that currency
     if display_currency:
-        exchange_rates = get_exchange_rates()
-        converted_balances = {}
+        return convert_balances(balances, display_currency)
 
-        # Check if the display currency is in the exchange rates
-        if display_currency not in exchange_rates:
-            # If not, return the original multi-currency balances
-            return balances
+    return balances
 
-        # Convert all balances to the display currency
-        for member_id, member_balances in balances.items():
-            total_balance = 0
+def aggregate_balances(group_id, include_settled=False):
+    """
+    Sum each participant's net for a group's expenses with one GROUP BY query
+    over expense_share. The payer is credited the full amount on their own share row.
+    Expenses written before expense_share existed get their rows from migration 0006.
 
-            for currency, amount in member_balances.items():
-                # Convert to USD first (as base currency)
-                usd_amount = amount / exchange_rates[currency]
-                # Then convert to the display currency
-                converted_amount = usd_amount * exchange_rates[display_currency]
-                total_balance += converted_amount
+    Args:
+        group_id: The ID of the group
+        include_settled: Whether to include settled expenses (default: False)
+
+    Returns:
+        A list of (user_id, currency, net amount in minor units) rows
+    """
+    conditions = [Expense.group_id == group_id]
+    if not include_settled:
+        conditions.append(Expense.settled == False)
+
+    return _net_shares_query(*conditions).all()
+
+def _net_shares_query(*conditions):
+    """Query each participant's net per currency over the expenses matching the conditions."""
+    credit = case((ExpenseShare.user_id == Expense.payer, Expense.amount_minor), else_=0)
+    return db.session.query(
+        ExpenseShare.user_id,
+        Expense.currency,
+        func.sum(credit - ExpenseShare.share_amount)
+    ).join(
+        Expense, Expense.id == ExpenseShare.expense_id
+    ).filter(
+        *conditions
+    ).group_by(
+        ExpenseShare.user_id, Expense.currency
+    )
+
+def convert_balances(balances, display_currency):
+    """
+    Convert multi-currency balances into a single display currency.
+
+    Args:
+        balances: Dictionary mapping user_id to a dictionary of currencies and amounts
+        display_currency: Currency to convert all balances to
+
+    Returns:
+        A dictionary mapping user_id to a single amount in the display currency,
+        or the original balances if the display currency has no exchange rate
+    """
+    exchange_rates = get_exchange_rates()
+    converted_balances = {}
 
-            converted_balances[member_id] = round(total_balance, 2)
+    # Check if the display currency is in the exchange rates
+    if display_currency not in exchange_rates:
+        # If not, return the original multi-currency balances
+        return balances
 
-        return converted_balances
+    # Convert all balances to the display currency
+    for member_id, member_balances in balances.items():
+        total_balance = 0
+
+        for currency, amount in member_balances.items():
+            if currency not in exchange_rates:
+                # No rate to convert with; leave it out rather than fail the whole page
+                logger.warning("No exchange rate for %s, left out of the %s balance", currency, display_currency)
+                continue
+
+            # Convert to USD first (as base currency)
+            usd_amount = amount / exchange_rates[currency]
+            # Then convert to the display currency
+            converted_amount = usd_amount * exchange_rates[display_currency]
+            total_balance += converted_amount
+
+        converted_balances[member_id] = round(total_balance, 2)
+
+    return converted_balances
+
+def apply_expense_to_ledger(expense, direction=1):
+    """
+    Add (or, with direction=-1, remove) an expense's shares to the group's balance ledger.
+    Call this after the expense has been added to the session or marked settled.
+    The caller is responsible for committing, so the ledger changes in the same
+    transaction as the expense itself.
+
+    Args:
+        expense: The expense object, with its participants attached
+        direction: 1 when the expense becomes open, -1 when it is settled
+    """
+    apply_ledger_deltas(expense.group_id, {
+        (user_id, expense.currency): direction * amount
+        for user_id, amount in expense.get_minor_shares().items()
+    })
+
+def apply_ledger_deltas(group_id, deltas):
+    """
+    Add amounts to a group's balance ledger with one INSERT ... ON CONFLICT DO UPDATE.
+    The changes must already be visible to the session (added, flushed or executed),
+    since a group without a ledger is rebuilt from the expense tables instead.
+    The caller is responsible for committing.
+
+    Args:
+        group_id: The ID of the group
+        deltas: Dictionary mapping (user_id, currency) to an amount in minor units
+    """
+    # Every change to a group's balances comes through here
+    bump_group_version(group_id)
+
+    if ensure_ledger(group_id):
+        # The rebuild already reflects these changes
+        return
+
+    if deltas:
+        # One upsert: the database adds to existing rows, so two first writes for the
+        # same member and currency can't both insert it, and concurrent writers don't
+        # overwrite each other
+        dialect_insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+        statement = dialect_insert(BalanceLedger).values([
+            {'group_id': group_id, 'user_id': user_id, 'currency': currency,
+             'net_minor': amount, 'updated_at': datetime.now()}
+            for (user_id, currency), amount in deltas.items()
+        ])
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[BalanceLedger.group_id, BalanceLedger.user_id, BalanceLedger.currency],
+            set_={
+                'net_minor': BalanceLedger.net_minor + statement.excluded.net_minor,
+                'updated_at': statement.excluded.updated_at,
+            }
+        ))
+
+    refresh_settlement_edges(group_id)
+
+# Expense IDs per aggregate query when settling; SQLite allows 32766 bound parameters by default
+SETTLE_CHUNK_SIZE = 500
+
+def settle_expenses(group_id, settled_by, expense_ids=None, between=None):
+    """
+    Mark a group's open expenses settled with one set-based UPDATE and remove
+    them from the balance ledger with aggregate queries over their shares.
+    Only rows the UPDATE actually changed are taken out of the ledger, so
+    concurrent settles can't count an expense twice.
+    The caller is responsible for committing.
+
+    Args:
+        group_id: The ID of the group
+        settled_by: ID of the user settling the expenses
+        expense_ids: Optional list of expense IDs to settle; IDs of other groups
+            or of settled expenses are ignored
+        between: Optional pair of user IDs; settles the expenses one of them paid
+            and the other took part in, with no other participants. Expenses that
+            also involve other members stay open, so their shares aren't wiped out
+
+    Returns:
+        A tuple (IDs of the settled expenses, set of their participants' IDs)
+    """
+    conditions = [Expense.group_id == group_id, Expense.settled == False]
+    if expense_ids is not None:
+        if not expense_ids:
+            return [], set()
+        conditions.append(Expense.id.in_(expense_ids))
+    if between:
+        first, second = between
+
+        def took_part(user_id):
+            return exists().where(
+                expense_participants.c.expense_id == Expense.id,
+                expense_participants.c.user_id == user_id
+            )
+
+        conditions.append(or_(
+            and_(Expense.payer == first, took_part(second)),
+            and_(Expense.payer == second, took_part(first))
+        ))
+        # Nobody else took part
+        conditions.append(~exists().where(
+            expense_participants.c.expense_id == Expense.id,
+            expense_participants.c.user_id.notin_([first, second])
+        ))
+
+    settled_ids = db.session.execute(
+        update(Expense).where(*conditions).values(
+            settled=True,
+            settled_at=datetime.now(),
+            settled_by=settled_by
+        ).returning(Expense.id),
+        execution_options={'synchronize_session': False}
+    ).scalars().all()
+    if not settled_ids:
+        return [], set()
+
+    deltas = defaultdict(int)
+    participant_ids = set()
+
+    # Aggregate in chunks so a large settle stays under the database's bound-parameter limit
+    for start in range(0, len(settled_ids), SETTLE_CHUNK_SIZE):
+        chunk = settled_ids[start:start + SETTLE_CHUNK_SIZE]
+
+        for user_id, currency, amount in _net_shares_query(Expense.id.in_(chunk)):
+            deltas[(user_id, currency)] -= int(amount)
+            participant_ids.add(user_id)
+
+        # Expenses stored before expense_share existed have no share rows; split them from their participants
+        unshared = Expense.query.options(selectinload(Expense.participants)).filter(
+            Expense.id.in_(chunk),
+            ~exists().where(ExpenseShare.expense_id == Expense.id)
+        ).all()
+        for expense in unshared:
+            for user_id, amount in expense.get_minor_shares().items():
+                deltas[(user_id, expense.currency)] -= amount
+                participant_ids.add(user_id)
+
+    apply_ledger_deltas(group_id, deltas)
+
+    return settled_ids, participant_ids
+
+def bump_group_version(group_id):
+    """
+    Increase a group's version, which invalidates the ETags of its pages.
+    The caller is responsible for committing.
+    """
+    db.session.execute(
+        update(Group).where(Group.id == group_id).values(version=Group.version + 1),
+        execution_options={'synchronize_session': False}
+    )
+
+def ensure_ledger(group_id):
+    """
+    Build the ledger for a group that has open expenses but no ledger rows yet,
+    e.g. a group created before the ledger existed.
+
+    Returns:
+        True if the ledger was rebuilt, False otherwise
+    """
+    if BalanceLedger.query.filter_by(group_id=group_id).first():
+        return False
+    if not Expense.query.filter_by(group_id=group_id, settled=False).first():
+        return False
+
+    rebuild_ledger(group_id)
+    return True
+
+def backfill_expense_shares(session, batch_size=500):
+    """
+    Store owed shares for expenses written before the expense_share table existed,
+    one batch at a time. Expenses without participants never get share rows.
+
+    Args:
+        session: Session to work in; the caller commits after each batch if it wants to
+        batch_size: Number of expenses per batch
+
+    Yields:
+        The number of expenses backfilled in each batch, after it has been flushed
+    """
+    while True:
+        expenses = session.query(Expense).options(
+            selectinload(Expense.participants)
+        ).outerjoin(
+            ExpenseShare, ExpenseShare.expense_id == Expense.id
+        ).filter(
+            ExpenseShare.expense_id.is_(None),
+            Expense.participants.any()
+        ).limit(batch_size).all()
+
+        if not expenses:
+            return
+
+        for expense in expenses:
+            expense.record_shares()
+        session.flush()
+
+        yield len(expenses)
+
+def groups_missing_ledger():
+    """Get the IDs of the groups that have open expenses but no ledger rows yet."""
+    return [group_id for (group_id,) in db.session.query(Expense.group_id).filter(
+        Expense.settled == False,
+        ~exists().where(BalanceLedger.group_id == Expense.group_id)
+    ).distinct()]
+
+def rebuild_ledger(group_id=None):
+    """
+    Regenerate the balance ledger from the expense and expense_participants tables.
+
+    Args:
+        group_id: Optional group to rebuild; rebuilds every group when omitted
+
+    Returns:
+        The number of ledger rows written
+    """
+    ledger_query = BalanceLedger.query
+    expense_query = Expense.query.options(selectinload(Expense.participants)).filter_by(settled=False)
+    if group_id:
+        ledger_query = ledger_query.filter_by(group_id=group_id)
+        expense_query = expense_query.filter_by(group_id=group_id)
+
+    ledger_query.delete(synchronize_session=False)
+
+    totals = defaultdict(int)
+    for expense in expense_query.yield_per(500):
+        for user_id, amount in expense.get_minor_shares().items():
+            totals[(expense.group_id, user_id, expense.currency)] += amount
+
+    for (ledger_group_id, user_id, currency), amount in totals.items():
+        db.session.add(BalanceLedger(ledger_group_id, user_id, currency, amount))
+
+    if group_id:
+        refresh_settlement_edges(group_id)
+    else:
+        SettlementEdge.query.delete(synchronize_session=False)
+        for ledger_group_id in {key[0] for key in totals}:
+            refresh_settlement_edges(ledger_group_id)
+
+    return len(totals)
+
+def refresh_settlement_edges(group_id):
+    """
+    Recompute the stored settlement plan of a group from its balance ledger.
+    This keeps the per-user view of who owes whom across groups current
+    without solving every group on each read.
+    """
+    db.session.flush()
+    SettlementEdge.query.filter_by(group_id=group_id).delete(synchronize_session=False)
+
+    currency_balances = defaultdict(dict)
+    # Read columns rather than ledger objects, which the upsert in apply_ledger_deltas bypasses
+    for row in db.session.query(BalanceLedger.user_id, BalanceLedger.currency, BalanceLedger.net_minor).filter(
+        BalanceLedger.group_id == group_id
+    ):
+        if row.net_minor:
+            currency_balances[row.currency][row.user_id] = row.net_minor
+
+    options = _solver_options()
+    for currency, user_balances in currency_balances.items():
+        for transfer in settlement.solve(user_balances, currency, **options)['transfers']:
+            db.session.add(SettlementEdge(
+                group_id, transfer['from'], transfer['to'], currency,
+                to_minor(transfer['amount'], currency)
+            ))
+
+def get_ledger_balances(group_id, members, display_currency=None):
+    """
+    Read the net balance for each member of a group from the balance ledger.
+    Returns the same shapes as calculate_balances with include_settled=False,
+    without loading any expenses.
+
+    Args:
+        group_id: The ID of the group
+        members: List of member objects
+        display_currency: Optional currency to convert all balances to
+    """
+    rows = db.session.query(BalanceLedger.user_id, BalanceLedger.currency, BalanceLedger.net_minor).filter(
+        BalanceLedger.group_id == group_id
+    ).all()
+
+    # A group created before the ledger existed has no rows until its next write
+    # or `flask --app main migrate` builds them. Reads never write, so sum its
+    # open expenses instead
+    if not rows:
+        expenses = Expense.query.options(
+            selectinload(Expense.participants)
+        ).filter_by(group_id=group_id, settled=False).all()
+        return calculate_balances(group_id, expenses, members, display_currency)
+
+    # Every member gets an entry for every currency with an outstanding balance
+    ledger = MinorLedger(member.id for member in members)
+    for row in rows:
+        if row.net_minor:
+            ledger.add(row.currency, row.user_id, row.net_minor)
+
+    balances = ledger.to_balances()
+
+    if display_currency:
+        return convert_balances(balances, display_currency)
 
     return balances
 
@@ -95,148 +448,310 @@ def get_settlement_plan(balances, display_currency=None):
     Returns:
         A list of dictionaries: [{'from': user_id, 'to': user_id, 'amount': float, 'currency': str}]
     """
-    # Create a settlement plan for each currency
-    settlement_plan = []
+    return [
+        transfer
+        for result in solve_settlements(balances, display_currency).values()
+        for transfer in result['transfers']
+    ]
+
+def solve_settlements(balances, display_currency=None):
+    """
+    Run the settlement solver for every currency in the balances.
+
+    Args:
+        balances: Dictionary of user balances (flat or per currency)
+        display_currency: Optional currency to use for all transactions
+
+    Returns:
+        A dictionary mapping currency to the solver result, which reports the
+        transfers and which strategy produced them (see settlement.solve)
+    """
+    options = _solver_options()
 
     # If display_currency is provided and balances is a flat dictionary (already converted)
     if display_currency and isinstance(next(iter(balances.values()), None), (int, float)):
-        # Create two lists: one for debtors and one for creditors
-        debtors = []  # people who owe money (negative balance)
-        creditors = []  # people who are owed money (positive balance)
-
-        for user_id, balance in balances.items():
-            if balance < -0.01:  # Small epsilon to handle floating point errors
-                debtors.append((user_id, abs(balance)))
-            elif balance > 0.01:
-                creditors.append((user_id, balance))
-
-        # Sort both lists by amount (descending)
-        debtors.sort(key=lambda x: x[1], reverse=True)
-        creditors.sort(key=lambda x: x[1], reverse=True)
-
-        # Generate settlement plan for this currency
-        i, j = 0, 0
-        while i < len(debtors) and j < len(creditors):
-            debtor_id, debt = debtors[i]
-            creditor_id, credit = creditors[j]
-
-            # Calculate the transaction amount
-            amount = min(debt, credit)
-
-            if amount > 0.01:  # Only add non-trivial transactions
-                settlement_plan.append({
-                    'from': debtor_id,
-                    'to': creditor_id,
-                    'amount': round(amount, 2),
-                    'currency': display_currency
-                })
-
-            # Update the remaining debt/credit
-            debt -= amount
-            credit -= amount
-
-            # Move to the next debtor/creditor if their balance is settled
-            if debt < 0.01:
-                i += 1
-            if credit < 0.01:
-                j += 1
-
-            # Update the lists with the new amounts
-            if i < len(debtors):
-                debtors[i] = (debtor_id, debt)
-            if j < len(creditors):
-                creditors[j] = (creditor_id, credit)
-    else:
-        # Get all currencies in the balances
-        all_currencies = set()
-        for user_balances in balances.values():
-            all_currencies.update(user_balances.keys())
-
-        # Process each currency separately
-        for currency in all_currencies:
-            # Create two lists: one for debtors and one for creditors
-            debtors = []  # people who owe money (negative balance)
-            creditors = []  # people who are owed money (positive balance)
-
-            for user_id, user_balances in balances.items():
-                if currency in user_balances:
-                    balance = user_balances[currency]
-                    if balance < -0.01:  # Small epsilon to handle floating point errors
-                        debtors.append((user_id, abs(balance)))
-                    elif balance > 0.01:
-                        creditors.append((user_id, balance))
-
-            # Sort both lists by amount (descending)
-            debtors.sort(key=lambda x: x[1], reverse=True)
-            creditors.sort(key=lambda x: x[1], reverse=True)
-
-            # Generate settlement plan for this currency
-            i, j = 0, 0
-            while i < len(debtors) and j < len(creditors):
-                debtor_id, debt = debtors[i]
-                creditor_id, credit = creditors[j]
-
-                # Calculate the transaction amount
-                amount = min(debt, credit)
-
-                if amount > 0.01:  # Only add non-trivial transactions
-                    settlement_plan.append({
-                        'from': debtor_id,
-                        'to': creditor_id,
-                        'amount': round(amount, 2),
-                        'currency': currency
-                    })
-
-                # Update the remaining debt/credit
-                debt -= amount
-                credit -= amount
-
-                # Move to the next debtor/creditor if their balance is settled
-                if debt < 0.01:
-                    i += 1
-                if credit < 0.01:
-                    j += 1
-
-                # Update the lists with the new amounts
-                if i < len(debtors):
-                    debtors[i] = (debtor_id, debt)
-                if j < len(creditors):
-                    creditors[j] = (creditor_id, credit)
-
-    return settlement_plan
+        minor_balances = {user_id: to_minor(balance, display_currency) for user_id, balance in balances.items()}
+        return {display_currency: settlement.solve(minor_balances, display_currency, **options)}
+
+    # Split the balances by currency and process each currency separately
+    currency_balances = defaultdict(dict)
+    for user_id, user_balances in balances.items():
+        for currency, balance in user_balances.items():
+            currency_balances[currency][user_id] = to_minor(balance, currency)
+
+    return {
+        currency: settlement.solve(user_balances, currency, **options)
+        for currency, user_balances in currency_balances.items()
+    }
+
+def _solver_options():
+    """Get the settlement solver limits from the configuration."""
+    from config import Config
+
+    return {
+        'exact_max_members': Config.SETTLEMENT_EXACT_MAX_MEMBERS,
+        'time_budget': Config.SETTLEMENT_TIME_BUDGET_MS / 1000.0,
+        'max_iterations': Config.SETTLEMENT_MAX_ITERATIONS
+    }
+
+def get_user_position(user_id, display_currency=None):
+    """
+    Get a user's net position across all of their groups, served from the
+    balance ledger and the stored settlement plans rather than by computing
+    every group's balances.
+
+    Args:
+        user_id: The ID of the user
+        display_currency: Optional currency to also express the totals in
+
+    Returns:
+        A dictionary with:
+            'balances': currency -> net amount (positive if owed, negative if owing)
+            'total': the net amount in display_currency, or None
+            'counterparties': list of {'user_id', 'username', 'balances', 'total'}
+                with debts to and from the same person netted across groups,
+                people the user owes first
+            'display_currency': the display currency used for totals, or None
+    """
+    totals = db.session.query(
+        BalanceLedger.currency, func.sum(BalanceLedger.net_minor)
+    ).filter(
+        BalanceLedger.user_id == user_id
+    ).group_by(BalanceLedger.currency).all()
+
+    edges = SettlementEdge.query.filter(
+        or_(SettlementEdge.from_user == user_id, SettlementEdge.to_user == user_id)
+    ).all()
+
+    # Net the suggested transfers per counterparty: negative means the user pays them
+    counterparty_totals = defaultdict(lambda: defaultdict(int))
+    for edge in edges:
+        if edge.from_user == user_id:
+            counterparty_totals[edge.to_user][edge.currency] -= edge.amount_minor
+        else:
+            counterparty_totals[edge.from_user][edge.currency] += edge.amount_minor
+
+    exchange_rates = get_exchange_rates() if display_currency else {}
+    if display_currency not in exchange_rates:
+        display_currency = None
+
+    def to_display(balances):
+        if not display_currency:
+            return None
+        total = 0
+        for currency, amount in balances.items():
+            if currency not in exchange_rates:
+                logger.warning("No exchange rate for %s, left out of the %s position", currency, display_currency)
+                continue
+            # Convert to USD first (as base currency), then to the display currency
+            total += amount / exchange_rates[currency] * exchange_rates[display_currency]
+        return round(total, 2)
+
+    usernames = dict(db.session.query(User.id, User.username).filter(
+        User.id.in_(list(counterparty_totals))
+    ).all()) if counterparty_totals else {}
+
+    counterparties = []
+    for counterparty_id, amounts in counterparty_totals.items():
+        balances = {currency: from_minor(amount, currency) for currency, amount in amounts.items() if amount}
+        if not balances:
+            continue
+        counterparties.append({
+            'user_id': counterparty_id,
+            'username': usernames.get(counterparty_id, "Unknown"),
+            'balances': balances,
+            'total': to_display(balances)
+        })
+
+    counterparties.sort(key=lambda c: (c['total'] if c['total'] is not None else sum(c['balances'].values()), c['username']))
+
+    balances = {currency: from_minor(int(amount), currency) for currency, amount in totals if amount}
+    return {
+        'balances': balances,
+        'total': to_display(balances),
+        'counterparties': counterparties,
+        'display_currency': display_currency
+    }
+
+DEFAULT_EXCHANGE_RATES = {
+    'USD': 1.0,
+    'EUR': 0.92,
+    'GBP': 0.79,
+    'CAD': 1.36,
+    'AUD': 1.52,
+    'JPY': 147.53,
+    'INR': 83.14,
+    'CNY': 7.14
+}
+
+_rate_cache = None
+
+def get_notification_badge(user_id, limit=5):
+    """
+    Get what the navigation bar needs about a user's notifications without loading
+    their history: an indexed COUNT of unread notifications and the newest few of them.
+
+    Args:
+        user_id: The ID of the user
+        limit: Maximum number of recent unread notifications to return
 
+    Returns:
+        A tuple (unread_count, recent_unread_notifications)
+    """
+    unread = Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.read == False
+    )
+    unread_count = unread.with_entities(func.count()).scalar()
+    if not unread_count:
+        return 0, []
+
+    recent = unread.order_by(Notification.created_at.desc()).limit(limit).all()
+    return unread_count, recent
+
+def take_unread_notifications(user_id):
+    """
+    Get a user's unread notifications as dictionaries and mark them as read, so
+    each one is delivered to the browser once. A single UPDATE ... RETURNING both
+    marks and fetches them, so a notification arriving meanwhile is neither lost
+    nor delivered twice. Commits the session.
+    """
+    rows = db.session.execute(
+        update(Notification).where(
+            Notification.user_id == user_id,
+            Notification.read == False
+        ).values(read=True).returning(
+            Notification.id, Notification.user_id, Notification.title,
+            Notification.message, Notification.link, Notification.created_at
+        ),
+        execution_options={'synchronize_session': False}
+    ).all()
+    db.session.commit()
+
+    return [{
+        'id': row.id,
+        'user_id': row.user_id,
+        'title': row.title,
+        'message': row.message,
+        'link': row.link,
+        'read': False,
+        'created_at': row.created_at
+    } for row in sorted(rows, key=lambda row: row.created_at or datetime.min)]
+
+def mark_notifications_read(user_id):
+    """
+    Mark all of a user's unread notifications as read with one UPDATE.
+    The caller is responsible for committing.
+
+    Returns:
+        The number of notifications marked
+    """
+    return db.session.execute(
+        update(Notification).where(
+            Notification.user_id == user_id,
+            Notification.read == False
+        ).values(read=True),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+
+def get_notification_page(user_id, cursor=None, page_size=30):
+    """
+    Get one page of a user's notifications, newest first, paginated on (created_at, id).
+
+    Args:
+        user_id: The ID of the user
+        cursor: Cursor from the previous page, or None for the first page
+        page_size: Number of notifications per page
+
+    Returns:
+        A tuple (notifications, next_cursor); next_cursor is None on the last page
+
+    Raises:
+        ValueError: If the cursor is not valid
+    """
+    query = Notification.query.filter(Notification.user_id == user_id)
+    if cursor:
+        created_at, notification_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Notification.created_at < created_at,
+            and_(Notification.created_at == created_at, Notification.id < notification_id)
+        ))
+
+    # Fetch one extra row to know whether there is a next page
+    notifications = query.order_by(
+        Notification.created_at.desc(), Notification.id.desc()
+    ).limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(notifications) > page_size:
+        notifications = notifications[:page_size]
+        next_cursor = encode_position(notifications[-1].created_at, notifications[-1].id)
+
+    return notifications, next_cursor
+
+def add_notifications(user_ids, title, message, link=None):
+    """
+    Give several users the same notification with one multi-row INSERT.
+    The caller is responsible for committing.
+    """
+    now = datetime.now()
+    rows = [{
+        'id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'title': title,
+        'message': message,
+        'link': link,
+        'read': False,
+        'created_at': now,
+    } for user_id in dict.fromkeys(user_ids)]
+    if rows:
+        db.session.execute(insert(Notification), rows)
+
+@span('exchange_rates')
 def get_exchange_rates():
     """
     Get currency exchange rates.
     Returns a dictionary of exchange rates where the key is the currency code
     and the value is the rate relative to USD.
 
-    Uses the currencyapi.com API if CURRENCY_API_KEY is set in environment variables.
+    Uses the currencyapi.com API if CURRENCY_API_KEY is set in environment variables,
+    through a cache shared by all workers (see rate_cache.RateCache).
     Otherwise, returns a fixed set of rates for demo purposes.
     """
+    global _rate_cache
     from config import Config
 
-    # Default rates for fallback
-    default_rates = {
-        'USD': 1.0,
-        'EUR': 0.92,
-        'GBP': 0.79,
-        'CAD': 1.36,
-        'AUD': 1.52,
-        'JPY': 147.53,
-        'INR': 83.14,
-        'CNY': 7.14
-    }
-
     # Get API key from config
     api_key = Config.CURRENCY_API_KEY
 
     # If no API key is provided, return default rates
     if not api_key:
-        print("Currency API key not found in environment variables. Using default rates.")
-        return default_rates
+        logger.debug("CURRENCY_API_KEY is not set, using the default exchange rates")
+        return dict(DEFAULT_EXCHANGE_RATES)
+
+    if _rate_cache is None:
+        from rate_cache import RateCache
+        _rate_cache = RateCache(
+            Config.EXCHANGE_RATE_CACHE_PATH,
+            Config.EXCHANGE_RATE_TTL,
+            lambda: fetch_exchange_rates(api_key)
+        )
+
+    # Fall back to the default rates until the first fetch succeeds
+    rates = _rate_cache.get()
+    return dict(rates) if rates else dict(DEFAULT_EXCHANGE_RATES)
+
+@span('exchange_rates.fetch')
+def fetch_exchange_rates(api_key):
+    """
+    Fetch real-time exchange rates relative to USD from currencyapi.com.
+
+    Returns:
+        dict: Rates keyed by currency code, or None if the request failed
+    """
+    # Imported here so processes that never fetch rates don't load the HTTP client
+    import requests
 
-    # Try to fetch real-time rates from the API
     try:
         url = f"https://api.currencyapi.com/v3/latest?apikey={api_key}&base_currency=USD"
         response = requests.get(url, timeout=5)
@@ -254,52 +769,13 @@ def get_exchange_rates():
 
             return rates
         else:
-            print(f"Error fetching exchange rates: {response.status_code} - {response.text}")
-            return default_rates
-
-    except Exception as e:
-        print(f"Error fetching exchange rates: {e}")
-        return default_rates
-
-def send_email(to_email, subject, html_content):
-    """
-    Send an email using the Resend API.
-
-    Args:
-        to_email (str): Recipient's email address
-        subject (str): Email subject
-        html_content (str): HTML content of the email
-
-    Returns:
-        dict: Response from the Resend API
-
-    Note:
-        This requires the RESEND_API_KEY environment variable to be set.
-    """
-    from config import Config
-
-    try:
-        # Initialize Resend API key from config
-        resend.api_key = Config.RESEND_API_KEY
-
-        # Check if API key is available
-        if not resend.api_key:
-            print("Resend API key not found in environment variables.")
-            return {"error": "API key not configured"}
-
-        # Prepare email parameters
-        params = {
-            "from": "ExpenseSplitter <notifications@expensesplitter.app>",
-            "to": [to_email],
-            "subject": subject,
-            "html": html_content
-        }
-
-        # Send the email
-        response = resend.Emails.send(params)
-        print(f"Email sent to {to_email}: {response}")
-        return response
+            logger.warning(
+                "Exchange rate API returned %s",
+                response.status_code,
+                extra={'status': response.status_code, 'body': response.text[:500]}
+            )
+            return None
 
     except Exception as e:
-        print(f"Error sending email: {e}")
-        return {"error": str(e)}
+        logger.warning("Error fetching exchange rates: %s", e)
+        return None
@@ -0,0 +1,40 @@
+"""
+Warm-up for a freshly started worker.
+
+Loads the exchange rates into the worker's cache and compiles every Jinja
+template, so the first requests after a cold start don't pay for either.
+gunicorn.conf.py runs it in each worker before the worker accepts traffic.
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+def warm_up(app):
+    """
+    Prime the exchange rate cache and compile the templates. Failures are logged,
+    never raised, so a slow or unreachable rate API can't keep a worker from starting.
+
+    Returns:
+        The number of templates compiled
+    """
+    started = time.perf_counter()
+
+    with app.app_context():
+        try:
+            from utils import get_exchange_rates
+            get_exchange_rates()
+        except Exception as e:
+            logger.warning("Warm-up could not load exchange rates: %s", e)
+
+        compiled = 0
+        for name in app.jinja_env.list_templates(extensions=['html']):
+            try:
+                app.jinja_env.get_template(name)
+                compiled += 1
+            except Exception as e:
+                logger.warning("Warm-up could not compile template %s: %s", name, e)
+
+    logger.info("Warm-up done in %.0f ms (%d templates)", (time.perf_counter() - started) * 1000, compiled)
+    return compiled